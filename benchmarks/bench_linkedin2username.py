@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks for linkedin2username.
+
+Covers the name mutation paths on synthetic name corpora, find_employees and
+check_page on the recorded search response, and do_loops end to end against a local stub
+server that replays paginated search results. Nothing here talks to LinkedIn.
+
+Run from the repository root:
+    python benchmarks/bench_linkedin2username.py [--quick] [--json results.json]
+
+Results are printed, and optionally saved as JSON. Pass a previous JSON file
+with --compare to see how things have changed.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import linkedin2username  # noqa: E402
+from linkedin2username import Employee, NameMutator  # noqa: E402
+from tests.helpers import StubServer, generate_names, legacy_clean_name, letters  # noqa: E402
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'mock-employee-response')
+
+
+def timed(func, *args):
+    """Returns the wall clock seconds taken to run func(*args)."""
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def bench_clean_name(sizes):
+    """Names per second through clean_name, before and after precompiling everything."""
+    results = {}
+    for count in sizes:
+        names = generate_names(count)
+
+        def run(clean):
+            for name in names:
+                clean(name)
+
+        before = timed(run, legacy_clean_name)
+        after = timed(run, NameMutator.clean_name)
+        print(f"[*] clean_name over {count} names:")
+        print(f"    legacy:  {count / before:12,.0f} names/sec")
+        print(f"    current: {count / after:12,.0f} names/sec ({before / after:.1f}x)")
+        results[count] = {'legacy_names_per_sec': count / before, 'names_per_sec': count / after}
+    return results
+
+
+def legacy_write_files(company, domain, employees, out_dir):
+    """The original write_files flow, which parsed every name once per format file."""
+    for suffix, name_func in linkedin2username.OUTPUT_FORMATS:
+        with open(f'{out_dir}/{company}-{suffix}.txt', 'w', encoding='utf-8') as outfile:
+            for employee in employees:
+                mutator = NameMutator(employee.full_name)
+                if mutator.name:
+                    for name in name_func(mutator.name):
+                        outfile.write(name + domain + '\n')
+
+
+def bench_write_files(sizes):
+    """Time and number of name parses spent in write_files."""
+    results = {}
+    for count in sizes:
+        employees = [Employee(name, 'Staff') for name in generate_names(count)]
+        parses = 0
+        original_split = NameMutator.split_name
+
+        def counting_split(name):
+            nonlocal parses
+            parses += 1
+            return original_split(name)
+
+        NameMutator.split_name = staticmethod(counting_split)
+        try:
+            with tempfile.TemporaryDirectory() as out_dir:
+                before = timed(legacy_write_files, 'bench', '@bench.com', employees, out_dir)
+                before_parses, parses = parses, 0
+                after = timed(linkedin2username.write_files, 'bench', '@bench.com', employees, out_dir)
+        finally:
+            NameMutator.split_name = staticmethod(original_split)
+
+        print(f"[*] write_files over {count} employees:")
+        print(f"    legacy:  {before:8.2f} sec, {before_parses:,} name parses")
+        print(f"    current: {after:8.2f} sec, {parses:,} name parses ({before / after:.1f}x)")
+        results[count] = {'legacy_seconds': before, 'legacy_parses': before_parses,
+                          'seconds': after, 'parses': parses, 'names_per_sec': count / after}
+    return results
+
+
+def bench_processes(sizes):
+    """Scaling of write_files from 1 to N worker processes."""
+    count = sizes[-1]
+    employees = [Employee(name, 'Staff') for name in generate_names(count)]
+    results = {}
+    print(f"[*] write_files over {count} employees, by number of processes:")
+    with tempfile.TemporaryDirectory() as out_dir:
+        baseline = None
+        for processes in sorted({1, 2, os.cpu_count() or 1}):
+            elapsed = timed(linkedin2username.write_files, 'bench', '', employees, out_dir,
+                            'exact', processes)
+            baseline = baseline or elapsed
+            print(f"    {processes:3} processes: {elapsed:8.2f} sec ({baseline / elapsed:.1f}x)")
+            results[processes] = {'seconds': elapsed, 'names_per_sec': count / elapsed}
+    return results
+
+
+def bench_memory(sizes):
+    """Peak memory (tracemalloc) of holding employee records, as dicts and as Employees."""
+    count = min(sizes[-1], 200000)
+    names = generate_names(count)
+    titles = [f'Senior Engineer {i}' for i in range(50)]
+
+    def build(make_record):
+        tracemalloc.start()
+        # Fresh occupation strings each time, as the JSON decoder would give us
+        records = [make_record(name, (titles[i % 50] + ' ')[:-1]) for i, name in enumerate(names)]
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del records
+        return peak
+
+    before = build(lambda name, occupation: {'full_name': name, 'occupation': occupation})
+    after = build(lambda name, occupation: Employee(name, sys.intern(occupation)))
+    print(f"[*] Peak memory holding {count} employees:")
+    print(f"    dicts:     {before / 1024 / 1024:8.1f} MiB")
+    print(f"    Employee:  {after / 1024 / 1024:8.1f} MiB ({before / after:.1f}x)")
+    return {'dict_peak_bytes': before, 'peak_bytes': after}
+
+
+def full_page_fixture(page=0, total=1000):
+    """
+    Blows the recorded search response up to a realistic 50 results per page,
+    with made up names that are unique to each page.
+    """
+    with open(FIXTURE, encoding='utf-8') as infile:
+        response = json.load(infile)
+    response['data']['searchDashClustersByAll']['paging']['total'] = total
+    elements = response['data']['searchDashClustersByAll']['elements']
+    items = [item for element in elements for item in element['items']]
+    elements[0]['items'] = []
+    for i in range(50):
+        item = json.loads(json.dumps(items[i % len(items)]))
+        item['item']['entityResult']['title']['text'] = f'Bench Person{letters(page, i)}'
+        elements[0]['items'].append(item)
+    return json.dumps(response)
+
+
+def bench_find_employees(sizes):
+    """Pages per second through find_employees, with each available JSON backend."""
+    count = 2000
+    page = full_page_fixture()
+    backends = {'json': json.loads}
+    try:
+        import orjson
+        backends['orjson'] = orjson.loads
+    except ImportError:
+        pass
+
+    results = {}
+    print(f"[*] find_employees over {count} pages of {len(page) / 1024:.0f} KiB:")
+    original = linkedin2username.json_loads
+    try:
+        for backend, loads in backends.items():
+            linkedin2username.json_loads = loads
+            elapsed = timed(lambda: [linkedin2username.find_employees(page) for _ in range(count)])
+            print(f"    {backend:8} {count / elapsed:10,.0f} pages/sec "
+                  f"({len(page) * count / elapsed / 1024 / 1024:.0f} MiB/sec)")
+            results[backend] = {'pages_per_sec': count / elapsed}
+    finally:
+        linkedin2username.json_loads = original
+    return results
+
+
+def legacy_check_page(result):
+    """The old check_page flow, which decoded the body to a str twice."""
+    if "UPSELL_LIMIT" in result.text:
+        return None, 0
+    return linkedin2username.parse_search(result.text)
+
+
+def bench_check_page(sizes):
+    """
+    CPU time and peak allocations per page through check_page, working on
+    str (the old way) and on the raw bytes.
+
+    Pages are real requests responses, both with a charset in the headers
+    and without, where requests has to guess the charset before decoding.
+    """
+    import requests
+
+    count = 500
+    body = full_page_fixture().encode('utf-8')
+
+    def response(content_type):
+        result = requests.Response()
+        result.status_code = 200
+        result._content = body
+        result.headers['Content-Type'] = content_type
+        return result
+
+    def run(check, content_type):
+        pages = [response(content_type) for _ in range(count)]
+        start = time.process_time()
+        for page in pages:
+            check(page)
+        elapsed = time.process_time() - start
+
+        page = response(content_type)
+        tracemalloc.start()
+        check(page)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return elapsed / count, peak
+
+    results = {}
+    print(f"[*] check_page over {count} pages of {len(body) / 1024:.0f} KiB:")
+    for charset, content_type in (('utf-8', 'application/vnd.linkedin.normalized+json+2.1; charset=UTF-8'),
+                                  ('guessed', 'application/vnd.linkedin.normalized+json+2.1')):
+        before, before_peak = run(legacy_check_page, content_type)
+        after, after_peak = run(linkedin2username.check_page, content_type)
+        print(f"    charset {charset}:")
+        print(f"      str:   {before * 1000:8.3f} ms/page, {before_peak / 1024:8.0f} KiB peak")
+        print(f"      bytes: {after * 1000:8.3f} ms/page, {after_peak / 1024:8.0f} KiB peak "
+              f"({before / after:.1f}x)")
+        results[charset] = {'legacy_ms_per_page': before * 1000, 'legacy_peak_bytes': before_peak,
+                            'ms_per_page': after * 1000, 'peak_bytes': after_peak}
+    return results
+
+
+def bench_do_loops(sizes, keywords=10, pages=20, latency=0.02):
+    """
+    Scrapes a fake company end to end through do_loops.
+
+    Each keyword has a full 1000 results, served by the stub server with a
+    little latency on every request to stand in for the network.
+    """
+    responses = [full_page_fixture(page, pages * 50) for page in range(pages)]
+
+    def responder(path):
+        time.sleep(latency)
+        page = int(path.split('start:')[1].split(',')[0]) // 50
+        keyword = path.split('keywords:')[1].split(',')[0]
+        return 200, responses[page].replace('Bench Person', f'Bench {keyword}Person')
+
+    results = {}
+    print(f"[*] do_loops over {keywords} keywords of {pages} pages, {latency * 1000:.0f}ms per request:")
+    stub = StubServer(responder)
+    original_url = linkedin2username.BASE_URL
+    linkedin2username.BASE_URL = stub.url
+    try:
+        for workers in (1, 4, 8):
+            args = argparse.Namespace(geoblast=False, keywords=[f'kw{letters(i)}' for i in range(keywords)],
+                                      split=False, depth=pages, sleep=0, workers=workers,
+                                      staff_count=0, dedup='exact', stale_pages=0, delta=False)
+            session = linkedin2username.new_session(workers)
+            with tempfile.TemporaryDirectory() as out_dir, open(os.devnull, 'w') as devnull:
+                with linkedin2username.OutputWriter('bench', '', out_dir) as writer:
+                    stdout, sys.stdout = sys.stdout, devnull
+                    try:
+                        elapsed = timed(linkedin2username.do_loops, session, '1234', range(keywords),
+                                        args, writer)
+                    finally:
+                        sys.stdout = stdout
+            print(f"    {workers:3} workers: {elapsed:8.2f} sec, {writer.count / elapsed:10,.0f} names/sec, "
+                  f"{len(stub.requests) / elapsed:8,.1f} requests/sec")
+            results[workers] = {'seconds': elapsed, 'names_per_sec': writer.count / elapsed,
+                                'requests_per_sec': len(stub.requests) / elapsed}
+            stub.requests.clear()
+    finally:
+        linkedin2username.BASE_URL = original_url
+        stub.close()
+    return results
+
+
+BENCHMARKS = {
+    'clean_name': bench_clean_name,
+    'write_files': bench_write_files,
+    'processes': bench_processes,
+    'memory': bench_memory,
+    'find_employees': bench_find_employees,
+    'check_page': bench_check_page,
+    'do_loops': bench_do_loops,
+}
+
+
+def compare(results, previous):
+    """Prints any numbers that changed by more than 10% since a previous run."""
+    print("\n[*] Compared to the previous run:")
+
+    def walk(new, old, path):
+        for key, value in new.items():
+            if isinstance(value, dict):
+                walk(value, old.get(key, {}), f"{path}{key}/")
+            elif isinstance(value, (int, float)) and old.get(key):
+                change = value / old[key]
+                if abs(change - 1) > 0.1:
+                    print(f"    {path}{key}: {old[key]:,.2f} -> {value:,.2f} ({change:.2f}x)")
+
+    # JSON keys are always strings, so numbers are converted to match
+    walk(json.loads(json.dumps(results)), previous, '')
+
+
+def parse_arguments():
+    """Handle user-supplied arguments"""
+    parser = argparse.ArgumentParser(description='Benchmarks for linkedin2username.')
+    parser.add_argument('--quick', default=False, action='store_true',
+                        help='Skip the 1M name corpus.')
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS),
+                        help='Only run this benchmark. Can be repeated.')
+    parser.add_argument('--json', type=str, action='store', default=False,
+                        help='Write the results to this JSON file.')
+    parser.add_argument('--compare', type=str, action='store', default=False,
+                        help='Previous JSON results to compare against.')
+    return parser.parse_args()
+
+
+def main():
+    """Main Function"""
+    args = parse_arguments()
+    sizes = [1000, 100000] if args.quick else [1000, 100000, 1000000]
+
+    results = {'python': platform.python_version(),
+               'platform': platform.platform(),
+               'cpus': os.cpu_count(),
+               'benchmarks': {}}
+    for name in args.only or BENCHMARKS:
+        results['benchmarks'][name] = BENCHMARKS[name](sizes)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as outfile:
+            json.dump(results, outfile, indent=2)
+        print(f"\n[*] Results written to {args.json}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as infile:
+            compare(results, json.load(infile))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,15 +11,39 @@ account in order to extract the most results.
 import os
 import sys
 import re
+import contextlib
+import hashlib
+import math
 import time
 import argparse
 import json
+import csv
 import urllib.parse
-import requests
-import urllib3
-
-from selenium import webdriver
-from selenium.common.exceptions import WebDriverException
+import threading
+import random
+import datetime
+import email.utils
+import queue
+import collections
+import sqlite3
+import zlib
+import itertools
+import functools
+import string
+import multiprocessing
+import cProfile
+import concurrent.futures
+
+# requests, urllib3 and selenium are slow to import, so they are only imported
+# where a session or browser is actually needed. That keeps --help, --offline
+# and importing NameMutator from another script fast.
+
+# orjson is optional, but decodes search results a lot faster than the standard
+# library when it is installed. Its errors are a subclass of json.JSONDecodeError.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 BANNER = r"""
 
@@ -35,6 +59,24 @@ BANNER = r"""
 
 """
 
+# All API requests are sent here. Handy to swap out for a local server when testing.
+BASE_URL = 'https://www.linkedin.com'
+
+# Each search returns this many results per page, and LinkedIn stops handing
+# out results after the search limit.
+RESULTS_PER_PAGE = 50
+SEARCH_LIMIT = 1000
+
+# Rate limits and server errors are retried this many times, backing off
+# from BACKOFF seconds and doubling each time. Responses with these status
+# codes are worth another try.
+RETRIES = 5
+BACKOFF = 1
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# The longest we'll pause for when a Retry-After header asks, in seconds
+MAX_RETRY_AFTER = 120
+
 # The dictionary below contains geo region codes. Because we are limited to 1000 results per search,
 # we can use this to batch searches across regions and get more results.
 # I found this in some random JS, so who knows if it will change.
@@ -87,6 +129,35 @@ GEO_REGIONS = {
     "ve": "101490751"
 }
 
+# Common non-English characters are folded into their closest plain English equivalent
+# before any other cleaning happens.
+ACCENT_TABLE = str.maketrans({
+    **dict.fromkeys("àáâãäå", "a"),
+    **dict.fromkeys("èéêë", "e"),
+    **dict.fromkeys("ìíîï", "i"),
+    **dict.fromkeys("òóôõö", "o"),
+    **dict.fromkeys("ùúûü", "u"),
+    **dict.fromkeys("ýÿ", "y"),
+    "ß": "ss",
+    "ñ": "n"
+})
+
+# Anything in (non-nested) parenthesis, or any single character that isn't a letter,
+# space, or dash. The parenthesis branch comes first so that it wins whenever it matches.
+JUNK_PATTERN = re.compile(r'\([^()]*\)|[^a-zA-Z -]')
+
+# Titles people like to add to their names. Thanks ChatGPT for the help.
+TITLES = ['mr', 'miss', 'mrs', 'phd', 'prof', 'professor', 'md', 'dr', 'mba']
+TITLES_PATTERN = re.compile("\\b(" + "|".join(TITLES) + ")\\b")
+
+# Names are split into parts on spaces and dashes (including repeated)
+SPLIT_PATTERN = re.compile(r'[\s-]+')
+
+
+# Compact records used everywhere instead of dicts, as big runs hold a lot of these
+Employee = collections.namedtuple('Employee', ['full_name', 'occupation'])
+SplitName = collections.namedtuple('SplitName', ['first', 'second', 'last'])
+
 
 class NameMutator():
     """
@@ -94,6 +165,8 @@ class NameMutator():
 
     Init with a raw name, and then call the individual functions to return a mutation.
     """
+    __slots__ = ('name',)
+
     def __init__(self, name):
         self.name = self.clean_name(name)
         self.name = self.split_name(self.name)
@@ -106,51 +179,38 @@ class NameMutator():
         LinkedIn users tend to add credentials to their names to look special.
         This function is based on what I have seen in large searches, and attempts
         to remove them.
+
+        All of the tables and patterns used here are built once at import time,
+        as this gets called for every single name we scrape.
         """
         # Lower-case everything to make it easier to de-duplicate.
         name = name.lower()
 
         # Use case for tool is mostly standard English, try to standardize common non-English
         # characters.
-        name = re.sub("[àáâãäå]", 'a', name)
-        name = re.sub("[èéêë]", 'e', name)
-        name = re.sub("[ìíîï]", 'i', name)
-        name = re.sub("[òóôõö]", 'o', name)
-        name = re.sub("[ùúûü]", 'u', name)
-        name = re.sub("[ýÿ]", 'y', name)
-        name = re.sub("[ß]", 'ss', name)
-        name = re.sub("[ñ]", 'n', name)
-
-        # Get rid of all things in parenthesis. Lots of people put various credentials, etc
-        name = re.sub(r'\([^()]*\)', '', name)
-
-        # The lines below basically trash anything weird left over.
-        # A lot of users have funny things in their names, like () or ''
-        # People like to feel special, I guess.
-        allowed_chars = re.compile('[^a-zA-Z -]')
-        name = allowed_chars.sub('', name)
-
-        # Next, we get rid of common titles. Thanks ChatGPT for the help.
-        titles = ['mr', 'miss', 'mrs', 'phd', 'prof', 'professor', 'md', 'dr', 'mba']
-        pattern = "\\b(" + "|".join(titles) + ")\\b"
-        name = re.sub(pattern, '', name)
-
-        # The line below tries to consolidate white space between words
-        # and get rid of leading/trailing spaces.
-        name = re.sub(r'\s+', ' ', name).strip()
-
-        return name
+        name = name.translate(ACCENT_TABLE)
+
+        # Get rid of all things in parenthesis (lots of people put various credentials, etc)
+        # and trash anything weird left over, like emojis or quotes, in a single pass.
+        name = JUNK_PATTERN.sub('', name)
+
+        # Next, we get rid of common titles.
+        name = TITLES_PATTERN.sub('', name)
+
+        # Only plain spaces can be left at this point, so this consolidates white space
+        # between words and gets rid of leading/trailing spaces.
+        return ' '.join(name.split())
 
     @staticmethod
     def split_name(name):
         """
-        Takes a name (string) and returns a list of individual name-parts (dict).
+        Takes a name (string) and returns the individual name-parts (SplitName).
 
         Some people have funny names. We assume the most important names are:
         first name, last name, and the name right before the last name (if they have one)
         """
         # Split on spaces and dashes (included repeated)
-        parsed = re.split(r'[\s-]+', name)
+        parsed = SPLIT_PATTERN.split(name)
 
         # Iterate and remove empty strings
         parsed = [part for part in parsed if part]
@@ -160,72 +220,278 @@ class NameMutator():
             return None
 
         if len(parsed) > 2:
-            split_name = {'first': parsed[0], 'second': parsed[-2], 'last': parsed[-1]}
+            split_name = SplitName(parsed[0], parsed[-2], parsed[-1])
         else:
-            split_name = {'first': parsed[0], 'second': '', 'last': parsed[-1]}
+            split_name = SplitName(parsed[0], '', parsed[-1])
 
         # Final sanity check to not proceed without first and last name
-        if not split_name['first'] or not split_name['last']:
+        if not split_name.first or not split_name.last:
             return None
 
         return split_name
 
     def f_last(self):
         """jsmith"""
-        names = set()
-        names.add(self.name['first'][0] + self.name['last'])
-
-        if self.name['second']:
-            names.add(self.name['first'][0] + self.name['second'])
-
-        return names
+        return compile_template('{f}{last}')(self.name)
 
     def f_dot_last(self):
         """j.smith"""
-        names = set()
-        names.add(self.name['first'][0] + '.' + self.name['last'])
-
-        if self.name['second']:
-            names.add(self.name['first'][0] + '.' + self.name['second'])
-
-        return names
+        return compile_template('{f}.{last}')(self.name)
 
     def last_f(self):
         """smithj"""
-        names = set()
-        names.add(self.name['last'] + self.name['first'][0])
-
-        if self.name['second']:
-            names.add(self.name['second'] + self.name['first'][0])
-
-        return names
+        return compile_template('{last}{f}')(self.name)
 
     def first_dot_last(self):
         """john.smith"""
-        names = set()
-        names.add(self.name['first'] + '.' + self.name['last'])
-
-        if self.name['second']:
-            names.add(self.name['first'] + '.' + self.name['second'])
-
-        return names
+        return compile_template('{first}.{last}')(self.name)
 
     def first_l(self):
         """johns"""
-        names = set()
-        names.add(self.name['first'] + self.name['last'][0])
-
-        if self.name['second']:
-            names.add(self.name['first'] + self.name['second'][0])
-
-        return names
+        return compile_template('{first}{l}')(self.name)
 
     def first(self):
         """john"""
-        names = set()
-        names.add(self.name['first'])
+        return compile_template('{first}')(self.name)
+
 
-        return names
+# Placeholders that can be used in username templates, in the order they are
+# passed to the format strings that templates are turned into
+TEMPLATE_FIELDS = ('first', 'f', 'last', 'l')
+
+
+def parse_template(template):
+    """
+    Checks a username template and turns it into a str.format() string, with
+    the name parts numbered as in TEMPLATE_FIELDS. So '{f}.{last}' becomes
+    '{1}.{2}'. Returns the format string and the set of placeholders used.
+
+    Raises ValueError for a bad template.
+    """
+    try:
+        parsed = list(string.Formatter().parse(template))
+    except ValueError as err:
+        raise ValueError(f"bad template {template!r}: {err}") from err
+
+    parts = []
+    fields = set()
+    for literal, field, format_spec, conversion in parsed:
+        # The template also names the output file
+        if '/' in literal or '\\' in literal:
+            raise ValueError(f"bad template {template!r}: slashes aren't allowed")
+        parts.append(literal.replace('{', '{{').replace('}', '}}'))
+        if field is None:
+            continue
+        if field not in TEMPLATE_FIELDS or format_spec or conversion:
+            raise ValueError(f"bad template {template!r}: unknown placeholder {{{field}}}, "
+                             f"use any of {', '.join('{' + name + '}' for name in TEMPLATE_FIELDS)}")
+        parts.append(f'{{{TEMPLATE_FIELDS.index(field)}}}')
+        fields.add(field)
+
+    if not fields:
+        raise ValueError(f"bad template {template!r}: it needs at least one placeholder")
+    return ''.join(parts), fields
+
+
+@functools.lru_cache(maxsize=None)
+def compile_template(template):
+    """
+    Compiles a username template into a function that mutates a SplitName.
+
+    Templates are plain text with placeholders for the parts of a name:
+    {first} and {f} for the first name and its initial, {last} and {l} for
+    the last name and its initial. So '{f}.{last}' gives j.smith.
+
+    People with a name before their last name (like John Davidson Smith)
+    often use either, so they get a second username using that one as {last}.
+
+    The template is checked and parsed once, so each name only costs a
+    str.format() call. The function returns a set of usernames. Raises
+    ValueError for a bad template.
+    """
+    render, fields = parse_template(template)
+    render = render.format
+
+    if not fields & {'last', 'l'}:
+        def mutate(name):
+            first = name[0]
+            return {render(first, first[0])}
+        return mutate
+
+    def mutate(name):
+        first, second, last = name
+        if second:
+            return {render(first, first[0], last, last[0]), render(first, first[0], second, second[0])}
+        return {render(first, first[0], last, last[0])}
+    return mutate
+
+
+def compile_formats(templates):
+    """
+    Compiles a list of username templates into (file suffix, function) pairs.
+
+    The suffix is just the template without its braces, so '{f}.{last}' goes
+    in the f.last file.
+    """
+    return [(template.replace('{', '').replace('}', ''), compile_template(template))
+            for template in templates]
+
+
+# The username formats written by default, in the order they are written.
+DEFAULT_TEMPLATES = ['{f}{last}', '{f}.{last}', '{first}{l}', '{first}.{last}', '{first}', '{last}{f}']
+
+# Each username format maps an output file suffix to the function used to
+# generate it from a SplitName.
+OUTPUT_FORMATS = compile_formats(DEFAULT_TEMPLATES)
+
+
+class Profiler():
+    """
+    Lightweight timing and counting for --profile.
+
+    Code wraps each stage of a run in `with PROFILER.stage('name'):`, and
+    counts things with PROFILER.add(). Both do nothing when profiling is
+    disabled, which is the default, so the overhead is close to zero.
+
+    When tracing, every stage is also kept as an event in Chrome's trace
+    format, which can be loaded into chrome://tracing or Perfetto.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.tracing = False
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.times = collections.Counter()
+        self.calls = collections.Counter()
+        self.counts = collections.Counter()
+        self.statuses = collections.Counter()
+        self.events = []
+
+    def enable(self, tracing=False):
+        """Starts profiling from scratch."""
+        self.__init__()
+        self.enabled = True
+        self.tracing = tracing
+
+    @contextlib.contextmanager
+    def _timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.times[name] += elapsed
+                self.calls[name] += 1
+                if self.tracing:
+                    self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(),
+                                        'tid': threading.get_ident(),
+                                        'ts': (start - self.start) * 1e6, 'dur': elapsed * 1e6})
+
+    def stage(self, name):
+        """Returns a context manager that times a stage, if profiling."""
+        if not self.enabled:
+            return NULL_CONTEXT
+        return self._timer(name)
+
+    def add(self, name, amount=1):
+        """Adds to a named counter, if profiling."""
+        if self.enabled:
+            with self.lock:
+                self.counts[name] += amount
+
+    def add_response(self, result):
+        """Counts an HTTP response, its size, and its status code, if profiling."""
+        if self.enabled:
+            with self.lock:
+                self.counts['requests'] += 1
+                self.counts['bytes'] += len(result.content)
+                self.statuses[result.status_code] += 1
+
+    def report(self):
+        """Prints a summary table of everything recorded."""
+        wall = time.perf_counter() - self.start
+        print(f"\n[*] Profile ({wall:.2f} sec wall clock):")
+        print(f"    {'stage':<10} {'calls':>8} {'total sec':>10} {'avg ms':>9} {'% wall':>7}")
+        for name, total in self.times.most_common():
+            print(f"    {name:<10} {self.calls[name]:>8} {total:>10.2f} "
+                  f"{total / self.calls[name] * 1000:>9.2f} {total / wall * 100:>6.0f}%")
+        print("    (stages run in parallel when using workers, so may add up to over 100%)")
+        print(f"    Requests: {self.counts['requests']}, "
+              f"{self.counts['bytes'] / 1024:.1f} KiB, "
+              f"status codes: {dict(self.statuses) or 'none'}")
+        print(f"    Names: {self.counts['names']}, {self.counts['names'] / wall:,.0f} names/sec")
+
+    def write_trace(self, path):
+        """Writes all recorded stages as a Chrome trace file."""
+        with open(path, 'w', encoding='utf-8') as outfile:
+            json.dump({'traceEvents': self.events}, outfile)
+
+
+# Shared by everything, so that any stage of a run can be timed
+NULL_CONTEXT = contextlib.nullcontext()
+PROFILER = Profiler()
+
+
+def parse_templates(value):
+    """
+    Splits up and checks the comma-separated --templates, exiting if any are
+    bad. Repeats are dropped, but different templates can't share an output file.
+    """
+    templates = [template.strip() for template in value.split(',')]
+    templates = list(dict.fromkeys(template for template in templates if template))
+    try:
+        suffixes = [suffix for suffix, _ in compile_formats(templates)]
+    except ValueError as err:
+        print(f"Sorry, {err}")
+        sys.exit()
+    if len(set(suffixes)) != len(suffixes):
+        print("Sorry, some of those templates would write to the same file: "
+              f"{', '.join(sorted({suffix for suffix in suffixes if suffixes.count(suffix) > 1}))}")
+        sys.exit()
+    return templates
+
+
+def check_arguments(args):
+    """Exits with a message if the options given don't work together."""
+    if args.workers < 1 or args.processes < 1:
+        print("Sorry, you need at least one worker and one process.")
+        sys.exit()
+
+    if bool(args.company) == bool(args.batch):
+        print("Sorry, you need either a --company or a --batch file of them, but not both.")
+        sys.exit()
+
+    if args.offline and not os.path.isfile(args.offline):
+        print(f"[!] Could not find {args.offline}.")
+        sys.exit()
+
+    if args.delta and args.offline:
+        print("Sorry, --delta needs to scrape. Leave out --offline.")
+        sys.exit()
+
+    if args.batch and args.offline:
+        print("Sorry, --offline works on one company at a time. Use --company instead.")
+        sys.exit()
+
+    # These two functions are not currently compatible, squashing this now:
+    if args.keywords and args.geoblast and not args.split:
+        print("Sorry, keywords and geoblast are currently not compatible. Use one or the other, "
+              "or --split to combine them as needed.")
+        sys.exit()
+
+
+def read_batch(path):
+    """Reads the company names from a --batch file, exiting if there aren't any."""
+    try:
+        companies = read_companies(path)
+    except OSError as err:
+        print(f"[!] Could not read the batch file: {err}")
+        sys.exit()
+    if not companies:
+        print(f"[!] No company names found in {path}.")
+        sys.exit()
+    return companies
 
 
 def parse_arguments():
@@ -239,25 +505,47 @@ def parse_arguments():
     parser = argparse.ArgumentParser(description=desc)
 
     parser.add_argument('-c', '--company', type=str, action='store',
-                        required=True,
+                        default=False,
                         help='Company name exactly as typed in the company '
                         'linkedin profile page URL.')
+    parser.add_argument('-b', '--batch', type=str, action='store',
+                        default=False,
+                        help='File with a list of company names to scrape one after '
+                        'another, one per line, instead of --company. Also writes '
+                        'merged-*.txt files with everyone from every company.')
     parser.add_argument('-n', '--domain', type=str, action='store',
                         default='',
                         help='Append a domain name to username output. '
-                        '[example: "-n uber.com" would output jschmoe@uber.com]'
+                        '[example: "-n uber.com" would output jschmoe@uber.com] '
+                        'Comma-separate several to get every username at each one.'
                         )
+    parser.add_argument('-t', '--templates', type=str, action='store',
+                        default=False,
+                        help='Comma-separated username formats to write, one file each. '
+                        'Use {first}, {f}, {last}, and {l} for the first and last names '
+                        'and their initials. [example: "-t \'{f}{last},{first}_{last}\'"] '
+                        'Defaults to ' + ','.join(DEFAULT_TEMPLATES).replace('%', '%%') + '.')
     parser.add_argument('-d', '--depth', type=int, action='store',
                         default=False,
                         help='Search depth (how many loops of 50). If unset, '
                         'will try to grab them all.')
-    parser.add_argument('-s', '--sleep', type=int, action='store', default=0,
-                        help='Seconds to sleep between search loops.'
-                        ' Defaults to 0.')
+    parser.add_argument('-s', '--sleep', type=float, action='store', default=0,
+                        help='Minimum seconds between search requests, no matter how'
+                        ' many workers are used. Can be a fraction. We slow down'
+                        ' by ourselves when LinkedIn pushes back. Defaults to 0.')
+    parser.add_argument('-w', '--workers', type=int, action='store', default=1,
+                        help='Number of search pages to fetch at once. Defaults to 1.')
     parser.add_argument('-x', '--proxy', type=str, action='store',
                         default=False,
                         help='Proxy server to use. WARNING: WILL DISABLE SSL '
                         'VERIFICATION. [example: "-p https://localhost:8080"]')
+    parser.add_argument('--session-file', type=str, action='store',
+                        default=os.path.expanduser('~/.li2u-session.json'),
+                        help='Where to save your LinkedIn session, so later runs can skip '
+                        'the browser login until it expires. Defaults to '
+                        '~/.li2u-session.json. Set to "" to never save it.')
+    parser.add_argument('--fresh-login', default=False, action="store_true",
+                        help='Log in with the browser even if there is a saved session.')
     parser.add_argument('-k', '--keywords', type=str, action='store',
                         default=False,
                         help='Filter results by a a list of command separated '
@@ -269,26 +557,76 @@ def parse_arguments():
                         help='Attempts to bypass the 1,000 record search limit'
                         ' by running multiple searches split across geographic'
                         ' regions.')
+    parser.add_argument('--split', default=False, action="store_true",
+                        help='Attempts to bypass the 1,000 record search limit by'
+                        ' splitting any search that is too big by region, then by'
+                        ' --keywords if provided, until every search fits.')
+    parser.add_argument('--stale-pages', type=int, action='store', default=0,
+                        help='Give up on a search after this many pages in a row'
+                        ' without anyone new. Handy when keywords overlap a lot.'
+                        ' Defaults to 0 (never give up).')
     parser.add_argument('-o', '--output', default="li2u-output", action="store",
                         help='Output Directory, defaults to li2u-output')
+    parser.add_argument('--cache', type=str, action='store', default=False,
+                        help='SQLite file to cache search results in. Re-running with '
+                        'the same cache skips already fetched pages.')
+    parser.add_argument('--cache-ttl', type=float, action='store', default=24,
+                        help='Hours before a cached page is fetched again. Defaults to 24.')
+    parser.add_argument('--resume', default=False, action="store_true",
+                        help='Continue an interrupted run, skipping the pages it '
+                        'already completed. Use the same options as the original run.')
+    parser.add_argument('-f', '--offline', type=str, action='store', default=False,
+                        help='Skip scraping and generate usernames from a rawnames or '
+                        'metadata file from a previous run, or from a --cache file.')
+    parser.add_argument('--company-id', type=str, action='store', default=False,
+                        help='With --offline and a --cache file holding several companies, '
+                        'the numerical id of the one to use.')
+    parser.add_argument('-p', '--processes', type=int, action='store', default=1,
+                        help='Number of processes used to generate usernames with '
+                        '--offline. Helps with huge name lists. Defaults to 1.')
+    parser.add_argument('--stats', default=False, action="store_true",
+                        help='Print HTTP stats at the end of the run: requests, '
+                        'connection reuse, bytes transferred, and latency.')
+    parser.add_argument('--profile', default=False, action="store_true",
+                        help='Print how long each stage of the run took (network, '
+                        'sleeping, parsing, writing), request counts, and names/sec.')
+    parser.add_argument('--profile-trace', type=str, action='store', default=False,
+                        help='Write every stage of the run to this file as a Chrome trace '
+                        '(chrome://tracing or ui.perfetto.dev). Implies --profile.')
+    parser.add_argument('--profile-dump', type=str, action='store', default=False,
+                        help='Write cProfile stats for the main thread to this file.')
+    parser.add_argument('--delta', default=False, action="store_true",
+                        help='Compare against the last run in the same --output directory. '
+                        'Searches stop once they only find people we already knew about, '
+                        'and new usernames also go in {company}-new-*.txt.')
+    parser.add_argument('--dedup', default='exact', choices=list(DEDUP_MODES),
+                        help='How to drop duplicate lines from the output files. '
+                        '"bloom" uses a fixed ~18MB of memory for huge runs, at the '
+                        'cost of very rarely dropping a unique line. Defaults to exact.')
 
     args = parser.parse_args()
 
-    # Proxy argument is fed to requests as a dictionary, setting this now:
-    args.proxy_dict = {"https": args.proxy}
+    # If appending email addresses, preparing these strings now:
+    # Blank entries (like from a trailing comma) are dropped.
+    domains = [domain.strip() for domain in args.domain.split(',')] if args.domain else []
+    args.domain = ['@' + domain for domain in domains if domain] or ['']
 
-    # If appending an email address, preparing this string now:
-    if args.domain:
-        args.domain = '@' + args.domain
+    # Username templates are checked now, rather than after a long scrape.
+    if args.templates:
+        args.templates = parse_templates(args.templates)
 
     # Keywords are fed in as a list. Splitting comma-separated user input now:
     if args.keywords:
         args.keywords = args.keywords.split(',')
 
-    # These two functions are not currently compatible, squashing this now:
-    if args.keywords and args.geoblast:
-        print("Sorry, keywords and geoblast are currently not compatible. Use one or the other.")
-        sys.exit()
+    # A trace is part of the profile
+    if args.profile_trace:
+        args.profile = True
+
+    check_arguments(args)
+
+    # Read the batch file now, so a typo doesn't cost a browser login
+    args.companies = read_batch(args.batch) if args.batch else [args.company]
 
     return args
 
@@ -297,6 +635,9 @@ def get_webdriver():
     """
     Try to get a working Selenium browser driver
     """
+    from selenium import webdriver
+    from selenium.common.exceptions import WebDriverException
+
     for browser in [webdriver.Firefox, webdriver.Chrome]:
         try:
             return browser()
@@ -305,12 +646,187 @@ def get_webdriver():
     return None
 
 
-def login():
+def new_session(pool_size=1, retries=3, backoff=0.5):
+    """Creates a requests session tuned for scraping.
+
+    The connection pool is sized to the number of pages fetched at once, so
+    every worker gets to keep its connection alive. Dropped connections are
+    retried with an exponential backoff, and responses are compressed with
+    whatever urllib3 knows how to decode.
+
+    Error responses like 429 and 5xx are left to fetch_page(), which slows
+    down every worker when they happen rather than just the one that got it.
+    """
+    import requests
+    import urllib3
+
+    session = requests.Session()
+
+    retry = urllib3.util.Retry(total=retries, backoff_factor=backoff, status=0,
+                               allowed_methods=['GET'], raise_on_status=False,
+                               respect_retry_after_header=False)
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    # This includes brotli (br) if it is installed
+    session.headers.update(urllib3.util.make_headers(accept_encoding=True))
+
+    return session
+
+
+class SessionStats():
+    """
+    Keeps track of every request sent through a session.
+
+    Records bytes over the wire (after compression) and in the decoded bodies,
+    and how long each request took. Connection reuse comes straight from
+    urllib3's connection pools.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.wire_bytes = 0
+        self.body_bytes = 0
+        session.hooks['response'].append(self.record)
+
+    def record(self, response, *args, **kwargs):
+        """Response hook, called by requests for each response."""
+        body = response.content
+        with self.lock:
+            self.latencies.append(response.elapsed.total_seconds())
+            self.wire_bytes += response.raw.tell() if response.raw else len(body)
+            self.body_bytes += len(body)
+
+    def connections(self):
+        """Returns the number of requests sent, and new connections opened to send them."""
+        requests_sent = connections = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                requests_sent += pools[key].num_requests
+                connections += pools[key].num_connections
+        return requests_sent, connections
+
+    def report(self):
+        """Prints a summary of everything recorded."""
+        requests_sent, connections = self.connections()
+        latencies = sorted(self.latencies)
+
+        print("\n[*] HTTP stats:")
+        print(f"    Requests:    {requests_sent} over {connections} connections "
+              f"({max(0, requests_sent - connections)} reused)")
+        print(f"    Transferred: {self.wire_bytes / 1024:.1f} KiB "
+              f"({self.body_bytes / 1024:.1f} KiB decoded)")
+        if latencies:
+            print(f"    Latency:     min {latencies[0]:.3f}s, "
+                  f"median {latencies[len(latencies) // 2]:.3f}s, "
+                  f"95th {latencies[int(len(latencies) * 0.95)]:.3f}s, "
+                  f"max {latencies[-1]:.3f}s")
+
+
+def prepare_session(cookies, pool_size=1, proxy=None):
+    """Builds a scraping session around a set of LinkedIn cookies.
+
+    If a proxy is given, every request goes through it, including the one
+    checking that a saved session still works.
+    """
+    session = new_session(pool_size)
+    for name, value in cookies.items():
+        session.cookies.set(name, value)
+
+    # Special options below when using a proxy server. Helpful for debugging
+    # the application in Burp Suite.
+    if proxy:
+        import urllib3
+        session.verify = False
+        urllib3.disable_warnings(category=urllib3.exceptions.InsecureRequestWarning)
+        session.proxies.update({"https": proxy})
+
+    # Add headers required for this tool to function
+    mobile_agent = ('Mozilla/5.0 (Linux; U; Android 4.4.2; en-us; SCH-I535 '
+                    'Build/KOT49H) AppleWebKit/534.30 (KHTML, like Gecko) '
+                    'Version/4.0 Mobile Safari/534.30')
+    session.headers.update({'User-Agent': mobile_agent,
+                            'X-RestLi-Protocol-Version': '2.0.0',
+                            'X-Li-Track': '{"clientVersion":"1.13.1665"}'})
+
+    # Set the CSRF token
+    return set_csrf_token(session)
+
+
+def save_session(session, path):
+    """Saves the session cookies, readable only by the current user.
+
+    Returns False if the file couldn't be written. That's not worth stopping
+    for, as the session itself is fine.
+    """
+    cookies = {'saved': time.time(),
+               'cookies': {cookie.name: cookie.value for cookie in session.cookies}}
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as outfile:
+            # os.open only applies the mode to new files, so tighten up any old one too
+            os.chmod(path, 0o600)
+            json.dump(cookies, outfile)
+    except OSError as err:
+        print(f"[!] Could not save the session to {path}: {err}")
+        return False
+    return True
+
+
+def load_session(path, pool_size=1, proxy=None):
+    """Loads a session saved by save_session, if it is still logged in.
+
+    Checking the session costs one small request. Returns None if there is no
+    saved session, or LinkedIn no longer accepts it.
+    """
+    import requests
+
+    try:
+        with open(path, encoding='utf-8') as infile:
+            cookies = json.load(infile)['cookies']
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError):
+        print(f"[!] Could not read the saved session in {path}, ignoring it.")
+        return None
+
+    if 'JSESSIONID' not in cookies:
+        return None
+
+    session = prepare_session(cookies, pool_size, proxy)
+    try:
+        # Logged out sessions are redirected to the login page
+        response = session.get(BASE_URL + '/voyager/api/me', allow_redirects=False)
+    except requests.exceptions.RequestException as err:
+        print(f"[!] Could not check the saved session: {err}")
+        return None
+
+    if response.status_code != 200:
+        print("[*] The saved session has expired, you will need to log in again.")
+        return None
+
+    return session
+
+
+def login(pool_size=1, session_file=None, fresh=False, proxy=None):
     """Creates a new authenticated session.
 
     This now uses Selenium because I got very tired playing cat/mouse
     with LinkedIn's login process.
+
+    If session_file is given, the session from the last login is used instead
+    as long as it is still good, and any new login is saved there for next
+    time. fresh ignores the saved session and always opens the browser.
     """
+    if session_file and not fresh:
+        session = load_session(session_file, pool_size, proxy)
+        if session:
+            print(f"[*] Using the saved session in {session_file}")
+            return session
+
     driver = get_webdriver()
 
     if driver is None:
@@ -327,20 +843,11 @@ def login():
     driver.quit()
 
     # Initialize and return a requests session
-    session = requests.Session()
-    for cookie in selenium_cookies:
-        session.cookies.set(cookie['name'], cookie['value'])
-
-    # Add headers required for this tool to function
-    mobile_agent = ('Mozilla/5.0 (Linux; U; Android 4.4.2; en-us; SCH-I535 '
-                    'Build/KOT49H) AppleWebKit/534.30 (KHTML, like Gecko) '
-                    'Version/4.0 Mobile Safari/534.30')
-    session.headers.update({'User-Agent': mobile_agent,
-                            'X-RestLi-Protocol-Version': '2.0.0',
-                            'X-Li-Track': '{"clientVersion":"1.13.1665"}'})
+    session = prepare_session({cookie['name']: cookie['value'] for cookie in selenium_cookies},
+                              pool_size, proxy)
 
-    # Set the CSRF token
-    session = set_csrf_token(session)
+    if session_file and save_session(session, session_file):
+        print(f"[*] Session saved to {session_file}, so you can skip logging in next time.")
 
     return session
 
@@ -364,7 +871,7 @@ def get_company_info(name, session):
     """
     escaped_name = urllib.parse.quote_plus(name)
 
-    response = session.get(('https://www.linkedin.com'
+    response = session.get((BASE_URL +
                             '/voyager/api/organization/companies?'
                             'q=universalName&universalName=' + escaped_name))
 
@@ -425,8 +932,11 @@ def set_outer_loops(args):
     """
     # If we are using geoblast or keywords, we need to define a numer of
     # "outer_loops". An outer loop will be a normal LinkedIn search, maxing
-    # out at 1000 results.
-    if args.geoblast:
+    # out at 1000 results. When splitting, we start with a single search and
+    # the outer loops are worked out as we go.
+    if args.split:
+        outer_loops = range(0, 1)
+    elif args.geoblast:
         outer_loops = range(0, len(GEO_REGIONS))
     elif args.keywords:
         outer_loops = range(0, len(args.keywords))
@@ -450,19 +960,23 @@ def set_inner_loops(staff_count, args):
     """
 
     # We will look for 50 names on each loop. So, we set a maximum amount of
-    # loops to the amount of staff / 50 +1 more to catch remainders.
-    loops = int((staff_count / 50) + 1)
+    # loops to the amount of staff / 50 +1 more to catch remainders. There's no
+    # point going past the search limit, and each search will be sized more
+    # accurately once we see its first page.
+    loops = min(int((staff_count / 50) + 1), SEARCH_LIMIT // RESULTS_PER_PAGE)
 
     print(f"[*] Company has {staff_count} profiles to check. Some may be anonymous.")
 
     # The lines below attempt to detect large result sets and compare that
     # with the command line arguments passed. The goal is to warn when you
     # may not get all the results and to suggest ways to get  more.
-    if staff_count > 1000 and not args.geoblast and not args.keywords:
+    if staff_count > 1000 and args.split:
+        print("[*] High staff count, splitting searches as needed. Let's rock.")
+    elif staff_count > 1000 and not args.geoblast and not args.keywords:
         print("[!] Note: LinkedIn limits us to a maximum of 1000"
               " results!\n"
-              "    Try the --geoblast or --keywords parameter to bypass")
-    elif staff_count < 1000 and args.geoblast:
+              "    Try the --split, --geoblast, or --keywords parameter to bypass")
+    elif staff_count < 1000 and args.geoblast and not args.split:
         print("[!] Geoblast is not necessary, as this company has"
               " less than 1,000 staff. Disabling.")
         args.geoblast = False
@@ -497,7 +1011,7 @@ def get_results(session, company_id, page, region, keyword):
     """
 
     # Build the base search URL.
-    url = ('https://www.linkedin.com/voyager/api/graphql?variables=('
+    url = (BASE_URL + '/voyager/api/graphql?variables=('
            f'start:{page * 50},'
            f'query:('
            f'{f"keywords:{keyword}," if keyword else ""}'
@@ -515,23 +1029,30 @@ def get_results(session, company_id, page, region, keyword):
     return result
 
 
-def find_employees(result):
+def parse_search(result):
     """
-    Takes the text response of an HTTP query, converts to JSON, and extracts employee details.
+    Takes the body of an HTTP response, converts to JSON, and extracts employee details.
+
+    Only the name, occupation, and total result count are pulled out of what is
+    a pretty huge response. Decoding is the expensive part, which is why orjson
+    is used when available. The body can be str or the raw bytes, which both
+    JSON decoders take directly, saving decoding it to a str first.
 
-    Returns a list of dictionary items, or False if none found.
+    Returns a tuple of (list of Employee items, total results for this search).
+    The list is False if none found.
     """
     found_employees = []
 
     try:
-        result_json = json.loads(result)
-    except json.decoder.JSONDecodeError:
+        result_json = json_loads(result)
+    except ValueError:
+        # Bad JSON, or bytes that aren't valid UTF-8
         print("\n[!] Yikes! Could not decode JSON when scraping this loop! :(")
         print("I'm going to bail on scraping names now, but this isn't normal. You should "
               "troubleshoot or open an issue.")
         print("Here's the first 200 characters of the HTTP reply which may help in debugging:\n\n")
-        print(result[:200])
-        return False
+        print(result[:200].decode('utf-8', 'replace') if isinstance(result, bytes) else result[:200])
+        return False, 0
 
     # Walk the data, being careful to avoid key errors
     data = result_json.get('data', {})
@@ -542,7 +1063,7 @@ def find_employees(result):
 
     # If we've ended up with empty dicts or zero results left, bail out
     if total == 0:
-        return False
+        return False, 0
 
     # The "elements" list is the mini-profile you see when scrolling through a
     # company's employees. It does not have all info on the person, like their
@@ -568,12 +1089,648 @@ def find_employees(result):
             # Some users are missing a primary subtitle
             occupation = entity.get('primarySubtitle', {}).get('text', '') if entity.get('primarySubtitle') else ''
 
-            found_employees.append({'full_name': full_name, 'occupation': occupation})
+            # Lots of people share the same occupation, so we only keep one copy of each
+            found_employees.append(Employee(full_name, sys.intern(occupation)))
 
-    return found_employees
+    return found_employees, total
 
 
-def do_loops(session, company_id, outer_loops, args):
+def find_employees(result):
+    """
+    Takes the text response of an HTTP query, converts to JSON, and extracts employee details.
+
+    Returns a list of Employee items, or False if none found.
+    """
+    return parse_search(result)[0]
+
+
+class Stopped(Exception):
+    """Raised by fetch_page when the Throttle is stopped, like after Ctrl-C."""
+
+
+class Throttle():
+    """
+    Paces requests, adapting to how the server is responding.
+
+    This is a token bucket shared by all fetching threads. A token comes in
+    every interval seconds, up to burst of them, and each request takes one.
+    The default burst of 1 keeps requests at least interval apart, no matter
+    how many pages are being fetched at once.
+
+    The interval starts at --sleep, which is also the fastest we'll ever go.
+    Rate limits and server errors double it (up to max_interval), and can
+    pause everyone for a while. Every healthy response shrinks it again by
+    10%, so we settle at the fastest pace the server is happy with.
+
+    Stopping the Throttle wakes up every thread waiting on it, so nothing
+    sits out a long pause after Ctrl-C.
+    """
+    def __init__(self, interval, burst=1, max_interval=60):
+        self.minimum = interval
+        self.interval = interval
+        self.burst = burst
+        self.max_interval = max_interval
+        self.lock = threading.Lock()
+        self.next_time = 0
+        self.paused_until = 0
+        self.stopped = threading.Event()
+
+    def wait(self):
+        """
+        Blocks until it is this caller's turn to send a request. Returns False
+        if the Throttle was stopped instead.
+        """
+        with self.lock:
+            now = time.monotonic()
+            # next_time is when the bucket will be empty, burst tokens ahead of now
+            start = max(now, self.next_time - (self.burst - 1) * self.interval, self.paused_until)
+            self.next_time = max(self.next_time, start) + self.interval
+
+        if start > now:
+            self.stopped.wait(start - now)
+        return not self.stopped.is_set()
+
+    def stop(self):
+        """Stops everyone waiting for their turn, and anyone who asks after this."""
+        self.stopped.set()
+
+    def backoff(self, pause=0):
+        """Slows down after a bad response, pausing every thread for pause seconds."""
+        with self.lock:
+            self.interval = min(self.max_interval, max(self.interval * 2, BACKOFF))
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+    def healthy(self):
+        """Speeds back up after a good response."""
+        with self.lock:
+            if self.interval > self.minimum:
+                self.interval *= 0.9
+                # Don't creep towards 0 forever
+                if self.interval - self.minimum < 0.01:
+                    self.interval = self.minimum
+
+
+def retry_after(result):
+    """Returns how many seconds a Retry-After header asks us to wait, or None if it doesn't."""
+    value = result.headers.get('Retry-After')
+    if value is None:
+        return None
+
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+
+    # It can also be a date
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+# Stands in for a requests response when a page is served from the ResponseCache
+CachedResponse = collections.namedtuple('CachedResponse', ['status_code', 'content'])
+
+
+class ResponseCache():
+    """
+    Stores raw search responses in a local SQLite database.
+
+    Pages are keyed on the search parameters, so re-running against the same
+    company (to change the domain, for example) doesn't need to hit LinkedIn
+    again. Entries older than the TTL are treated as missing and re-fetched.
+    """
+    def __init__(self, path, ttl_hours):
+        self.ttl = ttl_hours * 3600
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS pages ('
+                        'company_id TEXT, region TEXT, keyword TEXT, page INTEGER, '
+                        'fetched REAL, body BLOB, '
+                        'PRIMARY KEY (company_id, region, keyword, page))')
+        self.db.commit()
+
+    def get(self, company_id, region, keyword, page):
+        """Returns the cached body of a page, or None if missing or expired."""
+        with self.lock:
+            row = self.db.execute('SELECT fetched, body FROM pages WHERE company_id=? AND '
+                                  'region=? AND keyword=? AND page=?',
+                                  (company_id, region, keyword, page)).fetchone()
+            if row is None or time.time() - row[0] > self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return zlib.decompress(row[1])
+
+    def put(self, company_id, region, keyword, page, body):
+        """Stores the raw bytes of a page, replacing anything already there."""
+        compressed = zlib.compress(body)
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                            (company_id, region, keyword, page, time.time(), compressed))
+            self.db.commit()
+
+    def bodies(self, company_id=None):
+        """Yields the raw bytes of every cached page, or just one company's, regardless of age."""
+        if not company_id:
+            rows = self.db.execute('SELECT body FROM pages')
+        else:
+            rows = self.db.execute('SELECT body FROM pages WHERE company_id=?', (company_id,))
+        for (body,) in rows:
+            yield zlib.decompress(body)
+
+    def company_ids(self):
+        """Returns the ids of every company with pages in the cache."""
+        return sorted(row[0] for row in self.db.execute('SELECT DISTINCT company_id FROM pages'))
+
+    def close(self):
+        """Closes the database."""
+        self.db.close()
+
+
+def fetch_page(session, company_id, page, region, keyword, throttle, cache=None):
+    """
+    Grabs a single page of search results.
+
+    Pages are served from the cache if we have a fresh copy. Otherwise, we ask
+    LinkedIn (see request_page), caching any good responses.
+    """
+    if cache:
+        with PROFILER.stage('cache'):
+            body = cache.get(company_id, region, keyword, page)
+        if body is not None:
+            return CachedResponse(200, body)
+
+    result = request_page(session, company_id, page, region, keyword, throttle)
+
+    # Errors and the commercial search limit are temporary, so never cache those
+    if cache and result.status_code == 200 and b"UPSELL_LIMIT" not in result.content:
+        with PROFILER.stage('cache'):
+            cache.put(company_id, region, keyword, page, result.content)
+
+    return result
+
+
+def request_page(session, company_id, page, region, keyword, throttle):
+    """
+    Waits for our turn and asks LinkedIn for a page of search results.
+
+    Rate limits (429), server errors, and dropped connections are retried up
+    to RETRIES times. Each one slows down the shared Throttle, pausing every
+    worker before the next try (see backoff_pause). If it still hasn't
+    worked, the last response is returned for check_page() to complain about.
+
+    Raises Stopped if the Throttle is stopped while we wait.
+    """
+    import requests
+
+    for attempt in range(RETRIES + 1):
+        with PROFILER.stage('sleep'):
+            if not throttle.wait():
+                raise Stopped()
+        try:
+            with PROFILER.stage('network'):
+                result = get_results(session, company_id, page, region, keyword)
+        except requests.exceptions.RequestException as err:
+            if attempt == RETRIES:
+                raise
+            pause = backoff_pause(attempt)
+            print(f"\n[!] Request failed ({err}), trying again in {pause:.1f} sec")
+            throttle.backoff(pause)
+            continue
+        PROFILER.add_response(result)
+
+        if result.status_code not in RETRY_STATUSES:
+            throttle.healthy()
+            break
+        if attempt == RETRIES:
+            break
+
+        pause = backoff_pause(attempt, result)
+        print(f"\n[!] Got an HTTP {result.status_code}, slowing down and trying again in {pause:.1f} sec")
+        throttle.backoff(pause)
+
+    return result
+
+
+def backoff_pause(attempt, result=None):
+    """
+    Returns how long to pause before trying again. That's a 429's Retry-After,
+    capped at MAX_RETRY_AFTER, or an exponential backoff from BACKOFF.
+    """
+    asked = retry_after(result) if result is not None and result.status_code == 429 else None
+    if asked is not None:
+        return min(asked, MAX_RETRY_AFTER)
+
+    # A little jitter keeps workers from retrying in lockstep
+    return BACKOFF * 2 ** attempt * random.uniform(0.5, 1)
+
+
+def get_loop_params(current_loop, args):
+    """
+    Returns the region and keyword searched in a given outer loop, plus a
+    label to print when starting it.
+
+    Crafting the right URL is a bit tricky, so currently unnecessary
+    parameters are still being included but set to empty.
+    """
+    if args.split:
+        return '', '', ''
+
+    if args.geoblast:
+        region_name, region_id = list(GEO_REGIONS.items())[current_loop]
+        return region_id, '', f"region {region_name}"
+
+    if args.keywords:
+        keyword = args.keywords[current_loop]
+        return '', keyword, f"keyword {keyword}"
+
+    return '', '', ''
+
+
+def check_page(result):
+    """
+    Checks a single page of search results.
+
+    Returns a tuple of (employees, total results for this search). Employees is
+    a list, an empty list if we have reached the end of this outer loop, or None
+    if something went wrong and we should stop here.
+    """
+    if result.status_code != 200:
+        print(f"\n[!] Yikes, got an HTTP {result.status_code}. This is not normal")
+        print("Bailing from loops, but you should troubleshoot.")
+        return None, 0
+
+    # Everything works on the raw bytes. Asking requests for result.text
+    # decodes the whole body again every time, and may even guess at the
+    # character set first.
+
+    # Commercial Search Limit might be triggered
+    if b"UPSELL_LIMIT" in result.content:
+        sys.stdout.write('\n')
+        print("[!] You've hit the commercial search limit! "
+              "Try again on the 1st of the month. Sorry. :(")
+        return None, 0
+
+    found_employees, total = parse_search(result.content)
+
+    if not found_employees:
+        sys.stdout.write('\n')
+        print("[*] We have hit the end of the road! Moving on...")
+        return [], 0
+
+    return found_employees, total
+
+
+class Checkpoint():
+    """
+    An append-only journal of completed search pages.
+
+    Every page that comes back with names is written to the journal along with
+    the names found, as is the page that ended each outer loop. Pages that fail
+    are not recorded, so they are tried again when resuming.
+
+    Outer loops are identified by their region and keyword, not their index.
+
+    With --delta, the people from the last run go in the journal first. By the
+    time we resume, the metadata file they came from has been overwritten.
+    """
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.pages = collections.defaultdict(set)
+        self.stops = {}
+        self.totals = {}
+
+        if not resume and os.path.exists(path):
+            os.remove(path)
+        self.journal = open(path, 'a', encoding='utf-8')
+
+    def replay(self, writer):
+        """
+        Reads back the journal from a previous run, handing all the employees
+        found to the writer. Returns the employees restored.
+        """
+        restored = []
+        with open(self.path, encoding='utf-8') as infile:
+            for line in infile:
+                try:
+                    entry = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    # Probably the last line, cut short by a crash
+                    continue
+
+                if 'previous' in entry:
+                    continue
+                loop = (entry['region'], entry['keyword'])
+                if entry.get('end'):
+                    self.stops[loop] = min(entry['page'], self.stops.get(loop, entry['page']))
+                    continue
+
+                self.pages[loop].add(entry['page'])
+                # Journals from older versions didn't record totals
+                self.totals[loop] = entry.get('total', SEARCH_LIMIT)
+                for full_name, occupation in entry['employees']:
+                    employee = Employee(full_name, occupation)
+                    writer.write(employee)
+                    restored.append(employee)
+
+        return restored
+
+    def previous(self):
+        """
+        Returns the people from the last run recorded by record_previous, or
+        None if the journal doesn't have them.
+        """
+        with open(self.path, encoding='utf-8') as infile:
+            for line in infile:
+                if not line.startswith('{"previous"'):
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.decoder.JSONDecodeError:
+                    return None
+                return [Employee(full_name, occupation) for full_name, occupation in entry['previous']]
+        return None
+
+    def record_previous(self, employees):
+        """Records the people from the last run, for --delta."""
+        self.journal.write(json.dumps({'previous': employees}) + '\n')
+        self.journal.flush()
+
+    def is_done(self, region, keyword, page):
+        """Returns True if this page was completed or is past the end of its loop."""
+        loop = (region, keyword)
+        return page in self.pages[loop] or page >= self.stops.get(loop, page + 1)
+
+    def record(self, region, keyword, page, employees, total=0):
+        """
+        Records a completed page, and the total results its search reported.
+        An empty list of employees ends the loop.
+        """
+        entry = {'region': region, 'keyword': keyword, 'page': page}
+        if employees:
+            entry['employees'] = employees
+            entry['total'] = total
+        else:
+            entry['end'] = True
+        self.journal.write(json.dumps(entry) + '\n')
+        self.journal.flush()
+
+    def close(self):
+        """Closes the journal."""
+        self.journal.close()
+
+
+class Search():
+    """
+    A single outer loop: one LinkedIn search, which maxes out at 1000 results.
+
+    Tracks which page to fetch next and where the search ends. The end starts
+    out as the search depth, and shrinks once we know how many results there
+    are or hit an empty page.
+
+    facets lists the ways this search can still be split up (see split_search).
+    """
+    __slots__ = ('region', 'keyword', 'label', 'facets', 'next_page', 'stop_page', 'total', 'stale')
+
+    def __init__(self, region, keyword, label, depth, facets=()):
+        self.region = region
+        self.keyword = keyword
+        self.label = label
+        self.facets = facets
+        self.next_page = 0
+        self.stop_page = depth
+        self.total = None
+        self.stale = 0
+
+    def set_total(self, total):
+        """Sizes the search from the total results reported by LinkedIn."""
+        self.total = total
+        self.stop_page = min(self.stop_page, pages_needed(total))
+
+
+def pages_needed(total):
+    """Number of pages to fetch for a search, given its total results."""
+    return min(math.ceil(total / RESULTS_PER_PAGE), SEARCH_LIMIT // RESULTS_PER_PAGE)
+
+
+def get_facets(args):
+    """
+    Returns the facets that searches can be split by with --split.
+
+    Regions are always available. Keywords are only used if provided.
+    """
+    if not args.split:
+        return ()
+    if args.keywords:
+        return ('region', 'keyword')
+    return ('region',)
+
+
+def split_search(search, args):
+    """
+    Splits a search into one narrower search per value of its next facet.
+
+    The new searches keep everything the original one filtered on, and can
+    be split again by any facets left over.
+    """
+    facet, facets = search.facets[0], search.facets[1:]
+    label = search.label + ', ' if search.label else ''
+
+    if facet == 'region':
+        return [Search(region_id, search.keyword, f"{label}region {region_name}", args.depth, facets)
+                for region_name, region_id in GEO_REGIONS.items()]
+
+    return [Search(search.region, keyword, f"{label}keyword {keyword}", args.depth, facets)
+            for keyword in args.keywords]
+
+
+class SearchPlanner():
+    """
+    Works out which search pages to fetch next, across all the outer loops.
+
+    The first page of each search tells us how many results it has, and only
+    the pages needed to cover those are fetched after that. A search also
+    stops early if a page returns 0 names.
+
+    With --geoblast, the first page of every region is fetched before anything
+    else. That tells us how many results each region has, so empty regions are
+    skipped entirely and the rest are worked through biggest first, fetching
+    only as many pages as each one needs.
+
+    With --split, we start with a single search. Any search reporting more
+    than 1000 results is split up by region, and then by keyword, until every
+    search fits under the limit. Only those final searches are fetched in full.
+
+    With --stale-pages (or --delta), a search gives up after that many pages
+    in a row without anyone new.
+
+    If a Checkpoint is provided, every page is journaled and pages it has
+    already completed are skipped.
+    """
+    def __init__(self, outer_loops, args, checkpoint=None):
+        self.args = args
+        self.checkpoint = checkpoint
+        self.searches = [Search(*get_loop_params(current_loop, args), args.depth, get_facets(args))
+                         for current_loop in outer_loops]
+        self.probing = args.geoblast and not args.split
+        self.stale_pages = args.stale_pages or (1 if args.delta else 0)
+        self.started = set()
+
+    def size_search(self, search, total):
+        """Plans out a search once we know how big it is, splitting it if needed."""
+        search.set_total(total)
+
+        if total > SEARCH_LIMIT and search.facets:
+            print(f"\n[*] {total} results is too many for one search, "
+                  f"splitting by {search.facets[0]}")
+            self.searches.extend(split_search(search, self.args))
+            search.stop_page = 1
+        elif total > SEARCH_LIMIT and self.args.split:
+            print(f"\n[!] This search still has {total} results, "
+                  "we can only get the first 1000.")
+
+    def next_pages(self, slots, idle):
+        """
+        Yields up to slots (search, page) pairs to fetch, working through the
+        outer loops in order. idle means no pages are being fetched right now.
+        """
+        # Once every region has been probed, we know where the people are
+        if self.probing and idle and all(search.next_page for search in self.searches):
+            self.probing = False
+            self.searches.sort(key=lambda search: search.total or 0, reverse=True)
+            print(f"\n[*] Probed {len(self.searches)} regions, "
+                  f"{len([search for search in self.searches if search.total])} have results. "
+                  "Working through them biggest first.")
+
+        for search in self.searches:
+            while slots and self.is_ready(search):
+                page = search.next_page
+                search.next_page += 1
+                if self.is_done(search, page):
+                    continue
+
+                if search not in self.started and search.label and not self.probing:
+                    print(f"\n[*] Looping through {search.label}")
+                self.started.add(search)
+                slots -= 1
+                yield search, page
+
+    def is_ready(self, search):
+        """Returns True if the next page of a search can be fetched now."""
+        # Every search waits to hear its size before going any further
+        if search.next_page > 0 and (self.probing or search.total is None):
+            return False
+        return search.next_page < search.stop_page
+
+    def is_done(self, search, page):
+        """Returns True if the checkpoint already has this page."""
+        if not (self.checkpoint and self.checkpoint.is_done(search.region, search.keyword, page)):
+            return False
+        if page == 0 and search.total is None:
+            self.size_search(search, self.checkpoint.totals.get((search.region, search.keyword), 0))
+        return True
+
+    def page_done(self, search, page, employees, total):
+        """
+        Records a page that came back, or None if it failed. Returns False if
+        there was nobody on it, which ends the search.
+        """
+        if employees is not None and self.checkpoint:
+            self.checkpoint.record(search.region, search.keyword, page, employees, total)
+
+        if not employees:
+            search.stop_page = page
+            return False
+
+        if search.total is None:
+            self.size_search(search, total)
+        return True
+
+    def check_stale(self, search, page, new_names):
+        """Ends a search once it has gone --stale-pages without anyone new."""
+        search.stale = 0 if new_names else search.stale + 1
+        if self.stale_pages and search.stale >= self.stale_pages:
+            sys.stdout.write('\n')
+            print(f"[*] Nobody new in the last {search.stale} pages. Moving on...")
+            search.stop_page = page + 1
+
+
+def dedup_key(employee):
+    """
+    The key for the do_loops index, so minor differences in a name don't count.
+
+    Names in other scripts clean up to nothing, so those are keyed on the name
+    as given. Otherwise everyone with the same occupation would be one person.
+    """
+    name = NameMutator.clean_name(employee.full_name) or employee.full_name.casefold()
+    return name + '\0' + employee.occupation
+
+
+def build_index(dedup, known=()):
+    """Starts the do_loops index of everyone found, with known already in it."""
+    index = DEDUP_MODES[dedup]()
+    for employee in known:
+        index.add_new(dedup_key(employee))
+    return index
+
+
+def stop_fetching(executor, pending, shared):
+    """Cancels pages still waiting to be fetched, leaving a shared executor running."""
+    if not shared:
+        executor.shutdown(wait=False, cancel_futures=True)
+        return
+    for future in pending:
+        future.cancel()
+
+
+def read_page(future):
+    """Parses a fetched page, returning (None, 0) if the request failed."""
+    import requests
+
+    try:
+        with PROFILER.stage('parse'):
+            return check_page(future.result())
+    except requests.exceptions.RequestException as err:
+        print(f"\n[!] Yikes, the request failed: {err}")
+        return None, 0
+
+
+def report_coverage(found, staff_count):
+    """Prints how much of the staff count LinkedIn reports we found, if we know it."""
+    if staff_count:
+        print(f"\n[*] Found {found} unique people, covering "
+              f"{min(100, found * 100 // staff_count)}% of the "
+              f"{staff_count} staff LinkedIn reports.")
+
+
+def scrape_page(planner, index, search, page, future):
+    """
+    Handles a page as soon as it has been fetched. Returns the new employees
+    on it, or None if the page was past the end of its search or empty.
+    """
+    # A previous page already ended this outer loop
+    if page >= search.stop_page:
+        return None
+
+    sys.stdout.flush()
+    sys.stdout.write(f"[*] Scraping results on loop {str(page+1)}...    ")
+
+    found_employees, total = read_page(future)
+    if not planner.page_done(search, page, found_employees, total):
+        return None
+
+    new_employees = [employee for employee in found_employees if index.add_new(dedup_key(employee))]
+    PROFILER.add('names', len(found_employees))
+    planner.check_stale(search, page, len(new_employees))
+    return new_employees
+
+
+def do_loops(session, company_id, outer_loops, args, writer, cache=None, checkpoint=None,
+             executor=None, throttle=None, known=()):
     """
     Performs looping where the actual HTTP requests to scrape names occurs
 
@@ -584,167 +1741,614 @@ def do_loops(session, company_id, outer_loops, args):
 
     Has the concept of inner an outer loops. Outerloops come into play when
     using --keywords or --geoblast, both which attempt to bypass the 1,000
-    record search limit.
+    record search limit. Which pages to fetch is worked out by a SearchPlanner.
+
+    Up to args.workers pages are fetched at once, across all outer loops.
+
+    The same person often turns up in more than one outer loop. An index of
+    everyone found so far, keyed on their cleaned up name and occupation, means
+    only new people are handed to the OutputWriter and counted as new.
 
-    This function will stop searching if a loop returns 0 new names.
+    This is a pipeline. Worker threads fetch pages, which are parsed here as
+    they complete, and new employees are handed to a BackgroundWriter to be
+    mutated and written while the next pages are fetched. Only a few pages are
+    ever held at each step, and results are on disk as we go. Returns the
+    number of unique employees found.
+
+    If a ResponseCache is provided, pages are served from there when possible.
+
+    People in known are treated as already found, such as those restored
+    from a Checkpoint. With --delta, known also has everyone from the last run,
+    and any search stops at the first page with nobody new on it (or after
+    --stale-pages of them).
+
+    An executor and Throttle can be passed in to share them between companies
+    in batch mode. A shared executor is left running, and Ctrl-C is passed on
+    to the caller so it can stop the whole batch.
     """
-    # Crafting the right URL is a bit tricky, so currently unnecessary
-    # parameters are still being included but set to empty. You will see this
-    # below with geoblast and keywords.
-    employee_list = []
+    planner = SearchPlanner(outer_loops, args, checkpoint)
+    index = build_index(args.dedup, known)
+    pending = {}
+
+    throttle = throttle or Throttle(args.sleep)
+    shared = executor is not None
+    if not shared:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.workers)
+
+    # Mutating and writing names happens on its own thread, while we get on with
+    # the next page. Anything already handed over is still written after Ctrl-C.
+    background = BackgroundWriter(writer, max(4, args.workers * 2))
+    found = writer.count
 
     # We want to be able to break here with Ctrl-C and still write the names we have
     try:
-        for current_loop in outer_loops:
-            if args.geoblast:
-                region_name, region_id = list(GEO_REGIONS.items())[current_loop]
-                current_region = region_id
-                current_keyword = ''
-                print(f"\n[*] Looping through region {region_name}")
-            elif args.keywords:
-                current_keyword = args.keywords[current_loop]
-                current_region = ''
-                print(f"\n[*] Looping through keyword {current_keyword}")
-            else:
-                current_region = ''
-                current_keyword = ''
-
-            # This is the inner loop. It will search results 50 at a time.
-            for page in range(0, args.depth):
-                new_names = 0
-
-                sys.stdout.flush()
-                sys.stdout.write(f"[*] Scraping results on loop {str(page+1)}...    ")
-                result = get_results(session, company_id, page, current_region, current_keyword)
-
-                if result.status_code != 200:
-                    print(f"\n[!] Yikes, got an HTTP {result.status_code}. This is not normal")
-                    print("Bailing from loops, but you should troubleshoot.")
-                    break
-
-                # Commercial Search Limit might be triggered
-                if "UPSELL_LIMIT" in result.text:
-                    sys.stdout.write('\n')
-                    print("[!] You've hit the commercial search limit! "
-                          "Try again on the 1st of the month. Sorry. :(")
-                    break
-
-                found_employees = find_employees(result.text)
-
-                if not found_employees:
-                    sys.stdout.write('\n')
-                    print("[*] We have hit the end of the road! Moving on...")
-                    break
-
-                new_names += len(found_employees)
-                employee_list.extend(found_employees)
+        while True:
+            # Keep the pool full
+            for search, page in planner.next_pages(args.workers - len(pending), not pending):
+                future = executor.submit(fetch_page, session, company_id, page, search.region,
+                                         search.keyword, throttle, cache)
+                pending[future] = (search, page)
+            if not pending:
+                break
+
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                search, page = pending.pop(future)
+                new_employees = scrape_page(planner, index, search, page, future)
+                if new_employees is None:
+                    continue
+
+                background.write(new_employees)
+                new_names = len(new_employees)
+                found += new_names
 
                 sys.stdout.write(f"    [*] Added {str(new_names)} new names. "
-                                 f"Running total: {str(len(employee_list))}"
+                                 f"Running total: {str(found)}"
+                                 f"{f' of ~{args.staff_count} staff' if args.staff_count else ''}"
                                  "              \r")
-
-                # If the user has defined a sleep between loops, we take a little
-                # nap here.
-                time.sleep(args.sleep)
     except KeyboardInterrupt:
         print("\n\n[!] Caught Ctrl-C. Breaking loops and writing files")
+        # Pages already being fetched give up instead of waiting to retry
+        throttle.stop()
+        if shared:
+            raise
+    finally:
+        stop_fetching(executor, pending, shared)
+        background.close()
+
+    report_coverage(writer.count, args.staff_count)
+    return writer.count
+
+
+class SeenSet(set):
+    """
+    A plain set that reports whether an item is new while adding it.
+
+    This is the default way of de-duplicating output lines. It is exact, but
+    memory grows with every unique line written.
+    """
+    def add_new(self, item):
+        """Adds an item, returning True if it was not already present."""
+        if item in self:
+            return False
+        self.add(item)
+        return True
+
+
+class BloomFilter():
+    """
+    A fixed-size probabilistic set, for de-duplicating very large runs in bounded memory.
+
+    There is a small chance (error_rate) of a new item being reported as already seen,
+    which means the odd unique line could be missing from the output. Duplicates are
+    never reported as new.
+    """
+    def __init__(self, capacity=10000000, error_rate=0.001):
+        self.size = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add_new(self, item):
+        """Adds an item, returning True if it was (probably) not already present."""
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+
+        new = False
+        for i in range(self.hashes):
+            position = (first + i * second) % self.size
+            byte, bit = position >> 3, 1 << (position & 7)
+            if not self.bits[byte] & bit:
+                self.bits[byte] |= bit
+                new = True
+
+        return new
+
+
+DEDUP_MODES = {
+    'exact': SeenSet,
+    'bloom': BloomFilter
+}
+
+
+class OutputWriter():
+    """
+    Writes raw names, metadata, and username mutations to the output files.
+
+    Employees are written as soon as they are handed over, so the only thing held
+    in memory is the record of which lines have already been written. Duplicate
+    lines are dropped from every file, which keeps spray lists minimal.
+
+    There is a file for each username template, defaulting to DEFAULT_TEMPLATES.
+    domain is added to the end of every username. It can also be a list of
+    domains, to write each username once for every domain.
+
+    Everyone new is also handed on to each OutputWriter in forward. That is
+    how batch mode builds a single list across every company, and how --delta
+    writes out just the people found since the last run. They need to use the
+    same templates.
+
+    Use as a context manager, or call close() when done.
+    """
+    def __init__(self, company, domain, out_dir, dedup='exact', forward=(), templates=None):
+        # Check for and create an output directory to store the files.
+        os.makedirs(out_dir, exist_ok=True)
+
+        domains = [domain] if isinstance(domain, str) else domain
+        self.endings = [domain + '\n' for domain in domains]
+        self.formats = compile_formats(templates) if templates else OUTPUT_FORMATS
+        self.forward = forward
+        self.seen = DEDUP_MODES[dedup]()
+        self.count = 0
+
+        self._stack = contextlib.ExitStack()
+        self.rawfile = self._open(f'{out_dir}/{company}-rawnames.txt')
+        self.metafile = self._open(f'{out_dir}/{company}-metadata.txt')
+        self.outfiles = [(suffix, name_func, self._open(f'{out_dir}/{company}-{suffix}.txt'))
+                         for suffix, name_func in self.formats]
+
+        self.metadata = csv.writer(self.metafile, lineterminator='\n')
+        self.metadata.writerow(['full_name', 'occupation'])
+
+    def _open(self, path):
+        return self._stack.enter_context(open(path, 'w', encoding='utf-8'))
+
+    def write(self, employee, mutations=None):
+        """
+        Writes a single employee to all output files.
+
+        mutations can be passed in if mutate_name() was already run elsewhere,
+        like in a worker process.
+
+        Returns True if this was a new employee, or False if it was a duplicate.
+        """
+        full_name, occupation = employee
+
+        # The exact same person may show up more than once, like when found in
+        # multiple keyword searches. No point in mutating them twice.
+        if not self.seen.add_new('metadata\0' + full_name + '\0' + occupation):
+            return False
+
+        self.count += 1
+        self.metadata.writerow(employee)
+
+        if self.seen.add_new('rawnames\0' + full_name):
+            self.rawfile.write(full_name + '\n')
+
+        if mutations is None:
+            mutations = mutate_name(full_name, self.formats)
+
+        for (suffix, _, outfile), names in zip(self.outfiles, mutations):
+            for name in names:
+                if self.seen.add_new(suffix + '\0' + name):
+                    for ending in self.endings:
+                        outfile.write(name + ending)
+
+        for writer in self.forward:
+            writer.write(employee, mutations)
+
+        return True
+
+    def remember(self, employee):
+        """
+        Marks everything an employee would write as already written, without
+        writing it. Used to leave known people out of the --delta files.
+        """
+        full_name, occupation = employee
+        self.seen.add_new('metadata\0' + full_name + '\0' + occupation)
+        self.seen.add_new('rawnames\0' + full_name)
+        for (suffix, _, _), names in zip(self.outfiles, mutate_name(full_name, self.formats)):
+            for name in names:
+                self.seen.add_new(suffix + '\0' + name)
+
+    def close(self):
+        """Flushes and closes all output files."""
+        self._stack.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BackgroundWriter():
+    """
+    Hands employees to an OutputWriter on a thread of its own.
+
+    Pages of employees are queued up with write() and mutated and written in
+    the order they were given. The queue only holds max_pages, so if writing
+    falls behind, write() waits for it rather than using more memory.
+
+    close() writes whatever is left in the queue before returning.
+    """
+    def __init__(self, writer, max_pages=4):
+        self.writer = writer
+        self.queue = queue.Queue(max_pages)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            employees = self.queue.get()
+            if employees is None:
+                return
+            # Keep draining the queue after an error, so write() never blocks forever
+            if self.error:
+                continue
+            try:
+                with PROFILER.stage('write'):
+                    for employee in employees:
+                        self.writer.write(employee)
+            except Exception as err:
+                self.error = err
+
+    def write(self, employees):
+        """Queues up a page of employees to be written."""
+        if employees:
+            self.queue.put(employees)
+
+    def close(self):
+        """Waits for everything queued to be written, raising any error from writing."""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+
+def mutate_name(full_name, formats=OUTPUT_FORMATS):
+    """
+    Parses a name once and returns the set of usernames for every format in
+    formats, in the same order. Returns an empty list if the name can't be
+    used.
+    """
+    name = NameMutator(full_name).name
+    if not name:
+        return []
+    return [name_func(name) for _, name_func in formats]
+
 
-    return employee_list
+def mutate_names(names, templates=None):
+    """Runs mutate_name over a chunk of names. This is what worker processes run."""
+    formats = compile_formats(templates) if templates else OUTPUT_FORMATS
+    return [mutate_name(full_name, formats) for full_name in names]
 
 
-def write_lines(employees, name_func, domain, outfile):
+def mutate_parallel(employees, processes, chunk_size=5000, templates=None):
     """
-    Helper function to mutate names and write to an outfile
+    Mutates names across a pool of worker processes.
 
-    Needs to be called with a string variable in name_func that matches the class method
-    name in the NameMutator class.
+    Employees are split into chunks, with only a few chunks per worker in flight
+    at any time so that memory use stays bounded for huge inputs. Yields
+    (employee, mutations) tuples in the original order.
+
+    Compiled templates can't be sent to other processes, so each worker
+    compiles the templates for itself.
     """
-    for employee in employees:
-        mutator = NameMutator(employee["full_name"])
-        if mutator.name:
-            for name in getattr(mutator, name_func)():
-                outfile.write(name + domain + '\n')
+    with multiprocessing.Pool(processes) as pool:
+        in_flight = collections.deque()
+        chunks = iter(lambda: list(itertools.islice(employees, chunk_size)), [])
+
+        for chunk in chunks:
+            names = [employee.full_name for employee in chunk]
+            in_flight.append((chunk, pool.apply_async(mutate_names, (names, templates))))
+
+            while len(in_flight) > processes * 2:
+                chunk, result = in_flight.popleft()
+                yield from zip(chunk, result.get())
+
+        while in_flight:
+            chunk, result = in_flight.popleft()
+            yield from zip(chunk, result.get())
 
 
-def write_files(company, domain, employees, out_dir):
+def write_files(company, domain, employees, out_dir, dedup='exact', processes=1, templates=None):
     """Writes data to various formatted output files.
 
     After scraping and processing is complete, this function formats the raw
     names into common username formats and writes them into a directory called
     li2u-output unless specified.
 
-    See in-line comments for decisions made on handling special cases.
+    employees can be any iterable, including a generator, as it is streamed
+    through an OutputWriter. With more than one process, the name mutations
+    are spread across a pool of workers and merged back in order.
     """
+    with OutputWriter(company, domain, out_dir, dedup, templates=templates) as writer, PROFILER.stage('write'):
+        if processes > 1:
+            for employee, mutations in mutate_parallel(iter(employees), processes, templates=templates):
+                writer.write(employee, mutations)
+        else:
+            for employee in employees:
+                writer.write(employee)
+    PROFILER.add('names', writer.count)
 
-    # Check for and create an output directory to store the files.
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
 
-    # Write out all the raw and mutated names to files
-    with open(f'{out_dir}/{company}-rawnames.txt', 'w', encoding='utf-8') as outfile:
-        for employee in employees:
-            outfile.write(employee['full_name'] + '\n')
+def is_cache_file(path):
+    """Checks whether a file is a ResponseCache database, rather than a text file."""
+    with open(path, 'rb') as infile:
+        return infile.read(16) == b'SQLite format 3\x00'
 
-    with open(f'{out_dir}/{company}-metadata.txt', 'w', encoding='utf-8') as outfile:
-        outfile.write('full_name,occupation\n')
-        for employee in employees:
-            outfile.write(employee['full_name'] + ',' + employee["occupation"] + '\n')
 
-    with open(f'{out_dir}/{company}-flast.txt', 'w', encoding='utf-8') as outfile:
-        write_lines(employees, 'f_last', domain, outfile)
+def read_employees(path, company_id=None):
+    """
+    Streams employees back out of a previous run's files.
 
-    with open(f'{out_dir}/{company}-f.last.txt', 'w', encoding='utf-8') as outfile:
-        write_lines(employees, 'f_dot_last', domain, outfile)
+    Accepts a rawnames or metadata file written by this tool, or a response
+    cache database. A cache can hold pages for several companies, so pass
+    company_id to only read one of them. Files are read one line (or cached
+    page) at a time, so huge inputs are fine.
+    """
+    if is_cache_file(path):
+        cache = ResponseCache(path, 0)
+        try:
+            for body in cache.bodies(company_id):
+                yield from find_employees(body) or []
+        finally:
+            cache.close()
+        return
+
+    with open(path, encoding='utf-8', newline='') as infile:
+        # Metadata files have a header, rawnames files do not
+        if infile.readline().rstrip('\r\n') == 'full_name,occupation':
+            for row in csv.reader(infile):
+                # Older versions didn't quote commas, so anything past the first
+                # one is assumed to belong to the occupation.
+                if row and row[0]:
+                    yield Employee(row[0], sys.intern(','.join(row[1:])))
+            return
+
+        infile.seek(0)
+        for line in infile:
+            full_name = line.rstrip('\r\n')
+            if full_name:
+                yield Employee(full_name, '')
+
+
+def regenerate(args):
+    """Re-generates all the output files from a previous run, without scraping."""
+    formats = compile_formats(args.templates) if args.templates else OUTPUT_FORMATS
+    suffixes = ['rawnames', 'metadata'] + [suffix for suffix, _ in formats]
+    outputs = {os.path.realpath(f'{args.output}/{args.company}-{suffix}.txt') for suffix in suffixes}
+    if os.path.realpath(args.offline) in outputs:
+        print("[!] That would overwrite the file we are reading from. "
+              "Use a different --output or --company.")
+        sys.exit()
 
-    with open(f'{out_dir}/{company}-firstl.txt', 'w', encoding='utf-8') as outfile:
-        write_lines(employees, 'first_l', domain, outfile)
+    # A --cache shared by a --batch run holds everyone from every company
+    company_id = args.company_id
+    if is_cache_file(args.offline):
+        cache = ResponseCache(args.offline, 0)
+        company_ids = cache.company_ids()
+        cache.close()
+        if not company_id and len(company_ids) > 1:
+            print(f"[!] That cache has pages for {len(company_ids)} companies "
+                  f"({', '.join(company_ids)}). Pick one with --company-id.")
+            sys.exit()
+        if company_id and company_id not in company_ids:
+            print(f"[!] That cache has no pages for company id {company_id}.")
+            sys.exit()
+
+    print(f"[*] Generating usernames from {args.offline}, no scraping needed.")
+    write_files(args.company, args.domain, read_employees(args.offline, company_id), args.output,
+                args.dedup, args.processes, args.templates)
+
+
+def read_companies(path):
+    """Reads a batch file of company names, skipping blank lines, comments, and repeats."""
+    companies = []
+    with open(path, encoding='utf-8') as infile:
+        for line in infile:
+            company = line.split('#')[0].strip()
+            if company and company not in companies:
+                companies.append(company)
+    return companies
+
+
+def load_previous(company, args):
+    """Reads the people found by the last run for --delta, before they get overwritten."""
+    path = f'{args.output}/{company}-metadata.txt'
+    if not os.path.exists(path):
+        print(f"[*] No previous run found at {path}, so everyone will be new.")
+        return []
+
+    previous = list(read_employees(path))
+    print(f"[*] Loaded {len(previous)} people from the last run in {path}")
+    return previous
+
+
+def scrape_company(session, company, company_id, staff_count, args, cache=None,
+                   executor=None, throttle=None, merged=None):
+    """
+    Scrapes a single company, writing its output files as we go.
 
-    with open(f'{out_dir}/{company}-first.last.txt', 'w', encoding='utf-8') as outfile:
-        write_lines(employees, 'first_dot_last', domain, outfile)
+    args is copied, as the search depth and geoblast settings are worked out
+    for each company. Returns the number of unique people found.
 
-    with open(f'{out_dir}/{company}-first.txt', 'w', encoding='utf-8') as outfile:
-        write_lines(employees, 'first', domain, outfile)
+    With --delta, everyone from the last run is written out again first, and
+    searches stop once they only turn up people we already knew about. Only
+    usernames that weren't in the last run go in the {company}-new-* files.
+    """
+    args = argparse.Namespace(**vars(args))
+    args.company = company
+    args.staff_count = staff_count
 
-    with open(f'{out_dir}/{company}-lastf.txt', 'w', encoding='utf-8') as outfile:
-        write_lines(employees, 'last_f', domain, outfile)
+    # Define inner and outer loops
+    print("[*] Calculating inner and outer loops...")
+    args.depth, args.geoblast = set_inner_loops(staff_count, args)
+    outer_loops = set_outer_loops(args)
 
+    # Do the actual searching, writing the data to some files as we go.
+    print("[*] Starting search.... Press Ctrl-C to break and write files early.\n")
+    with contextlib.ExitStack() as stack:
+        # The journal is opened before any OutputWriter has created the directory
+        os.makedirs(args.output, exist_ok=True)
+        checkpoint = Checkpoint(f'{args.output}/{company}-checkpoint.jsonl', args.resume)
+        stack.callback(checkpoint.close)
+
+        # When resuming, the metadata file already holds the interrupted run,
+        # so the last run's people come from the journal instead
+        previous = checkpoint.previous() if args.delta and args.resume else None
+        if previous is None:
+            previous = load_previous(company, args) if args.delta else []
+            if args.delta:
+                checkpoint.record_previous(previous)
+
+        forward = [merged] if merged else []
+        if args.delta:
+            new_writer = stack.enter_context(OutputWriter(f'{company}-new', args.domain, args.output,
+                                                          args.dedup, templates=args.templates))
+            forward.append(new_writer)
+            for employee in previous:
+                new_writer.remember(employee)
+
+        writer = stack.enter_context(OutputWriter(company, args.domain, args.output, args.dedup, forward,
+                                                  args.templates))
+        for employee in previous:
+            writer.write(employee)
+
+        restored = []
+        if args.resume:
+            restored = checkpoint.replay(writer)
+            print(f"[*] Resumed {sum(map(len, checkpoint.pages.values()))} pages with "
+                  f"{writer.count} names from the last run.\n")
+        do_loops(session, company_id, outer_loops, args, writer, cache, checkpoint,
+                 executor, throttle, previous + restored)
+
+    if args.delta:
+        print(f"[*] {new_writer.count} new people since the last run, "
+              f"written to {args.output}/{company}-new-*.txt")
+
+    return writer.count
+
+
+def scrape_targets(session, targets, args, cache, executor, throttle, merged):
+    """
+    Scrapes each (company, company_id, staff_count) in turn, stopping early on
+    Ctrl-C. Returns (company, found, elapsed) for each company scraped.
+    """
+    progress = []
+    try:
+        for number, (company, company_id, staff_count) in enumerate(targets, 1):
+            if args.batch:
+                print(f"\n[*] Company {number} of {len(targets)}: {company}")
+            start = time.perf_counter()
+            found = scrape_company(session, company, company_id, staff_count, args, cache,
+                                   executor, throttle, merged)
+            elapsed = time.perf_counter() - start
+            progress.append((company, found, elapsed))
+            if args.batch:
+                print(f"[*] {company}: {found} people in {elapsed:.1f} sec "
+                      f"({found / elapsed if elapsed else 0:.1f} names/sec)")
+    except KeyboardInterrupt:
+        if args.batch:
+            print("[!] Skipping the rest of the companies.")
+    return progress
 
-def main():
-    """Main Function"""
-    print(BANNER + "\n\n\n")
-    args = parse_arguments()
+
+def report_batch(progress, merged):
+    """Prints how each company in a batch went, given (company, found, elapsed) for each."""
+    print("\n[*] Batch summary:")
+    for company, found, elapsed in progress:
+        print(f"    {company:<30} {found:>8} people {elapsed:>8.1f} sec "
+              f"{found / elapsed if elapsed else 0:>8.1f} names/sec")
+    print(f"    {'merged (unique)':<30} {merged.count:>8} people")
+
+
+def scrape(args):
+    """Logs in, scrapes each company, and writes the output files as we go."""
+    if args.proxy:
+        print("[!] Using a proxy, ignoring SSL errors. Don't get pwned.")
 
     # Instantiate a session by logging in to LinkedIn.
-    session = login()
+    session = login(args.workers, args.session_file, args.fresh_login, args.proxy)
 
     # If we can't get a valid session, we quit now. Specific errors are
     # printed to the console inside the login() function.
     if not session:
         sys.exit()
 
-    # Special options below when using a proxy server. Helpful for debugging
-    # the application in Burp Suite.
-    if args.proxy:
-        print("[!] Using a proxy, ignoring SSL errors. Don't get pwned.")
-        session.verify = False
-        urllib3.disable_warnings(category=urllib3.exceptions.InsecureRequestWarning)
-        session.proxies.update(args.proxy_dict)
+    stats = SessionStats(session) if args.stats else None
 
-    # Get basic company info
-    print("[*] Trying to get company info...")
-    company_id, staff_count = get_company_info(args.company, session)
+    # Look up every company first, so a typo doesn't stop us halfway through
+    targets = []
+    for company in args.companies:
+        print(f"[*] Trying to get company info for {company}...")
+        targets.append((company, *get_company_info(company, session)))
 
-    # Define inner and outer loops
-    print("[*] Calculating inner and outer loops...")
-    args.depth, args.geoblast = set_inner_loops(staff_count, args)
-    outer_loops = set_outer_loops(args)
+    cache = ResponseCache(args.cache, args.cache_ttl) if args.cache else None
 
-    # Do the actual searching
-    print("[*] Starting search.... Press Ctrl-C to break and write files early.\n")
-    employees = do_loops(session, company_id, outer_loops, args)
+    # Everything shares one session, pool of workers, and --sleep limit
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.workers)
+    throttle = Throttle(args.sleep)
+    merged = (OutputWriter('merged', args.domain, args.output, args.dedup, templates=args.templates)
+              if args.batch else None)
 
-    # Write the data to some files.
-    write_files(args.company, args.domain, employees, args.output)
+    try:
+        progress = scrape_targets(session, targets, args, cache, executor, throttle, merged)
+    finally:
+        throttle.stop()
+        executor.shutdown(wait=False, cancel_futures=True)
+        if merged:
+            merged.close()
+
+    if merged:
+        report_batch(progress, merged)
+
+    if cache:
+        print(f"\n[*] Cache: {cache.hits} hits, {cache.misses} misses")
+        cache.close()
+
+    if stats:
+        stats.report()
+
+
+def main():
+    """Main Function"""
+    print(BANNER + "\n\n\n")
+    args = parse_arguments()
+
+    if args.profile:
+        PROFILER.enable(tracing=bool(args.profile_trace))
+    if args.profile_dump:
+        profile = cProfile.Profile()
+        profile.enable()
+
+    # No need to scrape anything if we are just re-generating files
+    if args.offline:
+        regenerate(args)
+    else:
+        scrape(args)
+
+    if args.profile_dump:
+        profile.disable()
+        profile.dump_stats(args.profile_dump)
+        print(f"\n[*] cProfile stats written to {args.profile_dump}")
+    if args.profile:
+        PROFILER.report()
+    if args.profile_trace:
+        PROFILER.write_trace(args.profile_trace)
+        print(f"[*] Trace written to {args.profile_trace}")
 
     # Time to get hacking.
     print(f"\n\n[*] All done! Check out your lovely new files in {args.output}")
@@ -0,0 +1,108 @@
+"""
+Shared helpers for the tests and benchmarks: made up names, canned voyager
+responses, and a local server to serve them from.
+"""
+
+import http.server
+import json
+import random
+import re
+import threading
+import urllib.parse
+
+
+def legacy_clean_name(name):
+    """The original, regex-per-step clean_name. Used as a reference implementation."""
+    name = name.lower()
+    name = re.sub("[àáâãäå]", 'a', name)
+    name = re.sub("[èéêë]", 'e', name)
+    name = re.sub("[ìíîï]", 'i', name)
+    name = re.sub("[òóôõö]", 'o', name)
+    name = re.sub("[ùúûü]", 'u', name)
+    name = re.sub("[ýÿ]", 'y', name)
+    name = re.sub("[ß]", 'ss', name)
+    name = re.sub("[ñ]", 'n', name)
+    name = re.sub(r'\([^()]*\)', '', name)
+    name = re.compile('[^a-zA-Z -]').sub('', name)
+    titles = ['mr', 'miss', 'mrs', 'phd', 'prof', 'professor', 'md', 'dr', 'mba']
+    name = re.sub("\\b(" + "|".join(titles) + ")\\b", '', name)
+    name = re.sub(r'\s+', ' ', name).strip()
+    return name
+
+
+def generate_names(count, seed=1337):
+    """Builds a reproducible corpus of ugly, LinkedIn-style names."""
+    rng = random.Random(seed)
+    pieces = ['john', 'JOSÉ', 'Gonzáles', 'Ñuñez', 'Straße', 'Zoë', 'İlker', 'van', 'der',
+              'Davidson-Smith', 'Mr.', 'Dr', 'PhD,', 'MBA', 'md', 'professor', 'Prof.',
+              '(OSCP, OSCE)', '(he/him)', '((nested))', '(', ')', '🙂', '"Bob"', "O'Neil",
+              '-', '--', ' ', '\t', '\u00a0', 'Ÿves', 'ÀÉÎÕÜ', 'x', 'drmba', 'mrs.']
+    return [''.join(rng.choice(pieces) + rng.choice(['', ' ', '  ', '-'])
+                    for _ in range(rng.randint(1, 6)))
+            for _ in range(count)]
+
+
+def make_page(names, total):
+    """Builds a minimal voyager search response holding the given names."""
+    items = [{'item': {'entityResult': {'title': {'text': name},
+                                        'primarySubtitle': {'text': 'Staff'}}}}
+             for name in names]
+    return json.dumps({'data': {'searchDashClustersByAll': {
+        'paging': {'count': 50, 'start': 0, 'total': total},
+        'elements': [{'items': items}]}}})
+
+
+def page_of(path):
+    """Returns which page of results a stubbed search request is asking for."""
+    return int(re.search(r'start:(\d+)', path).group(1)) // 50
+
+
+def read_output(out_dir, company, suffix):
+    """Returns the lines of one of the files written for a company, like read_output(d, 'acme', 'flast')."""
+    with open(f'{out_dir}/{company}-{suffix}.txt', encoding='utf-8') as infile:
+        return infile.read().splitlines()
+
+
+class StubServer():
+    """
+    Serves canned voyager responses from a local HTTP server.
+
+    responder is called with the decoded request path and returns (status, body),
+    or (status, body, headers) to send some extra headers.
+    Every path requested is recorded in self.requests.
+    """
+    def __init__(self, responder):
+        stub = self
+        self.requests = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                path = urllib.parse.unquote(self.path)
+                stub.requests.append(path)
+                status, body, *headers = responder(path)
+                body = body.encode('utf-8')
+                self.send_response(status)
+                for name, value in (headers[0] if headers else {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def letters(*numbers):
+    """Turns numbers into letters, so that made up names survive being cleaned."""
+    return 'x'.join(''.join(chr(ord('a') + int(digit)) for digit in str(number)) for number in numbers)
@@ -1,5 +1,20 @@
+import argparse
+import collections
+import email.utils
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+import requests
+
 import linkedin2username
-from linkedin2username import NameMutator
+from linkedin2username import Employee, NameMutator, SplitName
+from tests.helpers import StubServer, generate_names, legacy_clean_name, letters, make_page, page_of, read_output
 
 # Test name mutations
 
@@ -158,17 +173,22 @@ def test_clean_name():
     assert mutator.clean_name(name) == "cert dude"
 
 
+def test_clean_name_matches_legacy():
+    for name in generate_names(20000):
+        assert NameMutator.clean_name(name) == legacy_clean_name(name), name
+
+
 def test_split_name():
     mutator = NameMutator("xxx")
 
     name = "madonna wayne gacey"
-    assert mutator.split_name(name) == {"first": "madonna", "second": "wayne", "last": "gacey"}
+    assert mutator.split_name(name) == SplitName("madonna", "wayne", "gacey")
 
     name = "twiggy ramirez"
-    assert mutator.split_name(name) == {"first": "twiggy", "second": "", "last": "ramirez"}
+    assert mutator.split_name(name) == SplitName("twiggy", "", "ramirez")
 
     name = "brian warner is marilyn manson"
-    assert mutator.split_name(name) == {"first": "brian", "second": "marilyn", "last": "manson"}
+    assert mutator.split_name(name) == SplitName("brian", "marilyn", "manson")
 
 
 def test_find_employees():
@@ -177,10 +197,779 @@ def test_find_employees():
     employees = linkedin2username.find_employees(result)
 
     assert len(employees) == 2
-    assert employees[0] == {'full_name': 'Michael Myers', 'occupation': 'Camp Counsellor'}
-    assert employees[1] == {'full_name': 'Freddy Krueger', 'occupation': 'Babysitter'}
+    assert employees[0] == Employee('Michael Myers', 'Camp Counsellor')
+    assert employees[1] == Employee('Freddy Krueger', 'Babysitter')
 
     with open("tests/mock-employee-response-last-page", "r") as infile:
         result = infile.read()
     assert not linkedin2username.find_employees(result)
 
+
+def test_write_files(tmp_path):
+    employees = [Employee('John Davidson-Smith', 'Hacker'),
+                 Employee('🙂', 'Nobody'),
+                 Employee('José Gonzáles', '')]
+    linkedin2username.write_files('acme', '@acme.com', employees, str(tmp_path))
+
+    assert read_output(tmp_path, 'acme', 'rawnames') == ['John Davidson-Smith', '🙂', 'José Gonzáles']
+    assert read_output(tmp_path, 'acme', 'metadata') == [
+        'full_name,occupation', 'John Davidson-Smith,Hacker', '🙂,Nobody', 'José Gonzáles,']
+    assert sorted(read_output(tmp_path, 'acme', 'flast')) == [
+        'jdavidson@acme.com', 'jgonzales@acme.com', 'jsmith@acme.com']
+    assert sorted(read_output(tmp_path, 'acme', 'f.last')) == [
+        'j.davidson@acme.com', 'j.gonzales@acme.com', 'j.smith@acme.com']
+    assert sorted(read_output(tmp_path, 'acme', 'firstl')) == [
+        'johnd@acme.com', 'johns@acme.com', 'joseg@acme.com']
+    assert sorted(read_output(tmp_path, 'acme', 'first.last')) == [
+        'john.davidson@acme.com', 'john.smith@acme.com', 'jose.gonzales@acme.com']
+    assert read_output(tmp_path, 'acme', 'first') == ['john@acme.com', 'jose@acme.com']
+    assert sorted(read_output(tmp_path, 'acme', 'lastf')) == [
+        'davidsonj@acme.com', 'gonzalesj@acme.com', 'smithj@acme.com']
+
+
+def test_write_files_dedup(tmp_path):
+    employees = [Employee('John Smith', 'Hacker'),
+                 Employee('John Smith', 'Hacker'),
+                 Employee('John Smith', 'Painter'),
+                 Employee('Jane Smith', 'Hacker')]
+
+    for dedup in ('exact', 'bloom'):
+        linkedin2username.write_files('acme', '', iter(employees), str(tmp_path), dedup)
+
+        assert read_output(tmp_path, 'acme', 'rawnames') == ['John Smith', 'Jane Smith']
+        assert read_output(tmp_path, 'acme', 'metadata') == [
+            'full_name,occupation', 'John Smith,Hacker', 'John Smith,Painter', 'Jane Smith,Hacker']
+        assert read_output(tmp_path, 'acme', 'flast') == ['jsmith']
+        assert read_output(tmp_path, 'acme', 'first.last') == ['john.smith', 'jane.smith']
+
+
+def test_templates():
+    # The defaults are the six formats this tool has always written
+    assert [suffix for suffix, _ in linkedin2username.OUTPUT_FORMATS] == [
+        'flast', 'f.last', 'firstl', 'first.last', 'first', 'lastf']
+
+    name = SplitName('john', 'davidson', 'smith')
+    assert linkedin2username.compile_template('{first}_{last}')(name) == {'john_smith', 'john_davidson'}
+    assert linkedin2username.compile_template('{l}{f}-admin')(name) == {'sj-admin', 'dj-admin'}
+    assert linkedin2username.compile_template('{first}{f}')(name) == {'johnj'}
+    assert linkedin2username.compile_template("{f}'{last}")(SplitName('john', '', 'smith')) == {"j'smith"}
+
+    for template in ('{f}{n}', '{first!r}', '{last:>10}', '{first.upper}', 'admin/{f}', 'admin', '{first'):
+        with pytest.raises(ValueError):
+            linkedin2username.compile_template(template)
+
+
+def test_parse_domains_and_templates(monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['linkedin2username.py', '-c', 'acme', '-n', 'a.com,, b.com,',
+                                      '-t', '{f}{last},{first}.{last},{f}{last},'])
+    args = linkedin2username.parse_arguments()
+    assert args.domain == ['@a.com', '@b.com']
+    assert args.templates == ['{f}{last}', '{first}.{last}']
+
+    # Different templates can't share an output file
+    monkeypatch.setattr(sys, 'argv', ['linkedin2username.py', '-c', 'acme', '-t', '{first}{l},{f}irst{l}'])
+    with pytest.raises(SystemExit):
+        linkedin2username.parse_arguments()
+
+
+def test_parse_batch(tmp_path, monkeypatch):
+    # A missing or empty batch file is caught before logging in
+    monkeypatch.setattr(sys, 'argv', ['linkedin2username.py', '-b', f'{tmp_path}/missing.txt'])
+    with pytest.raises(SystemExit):
+        linkedin2username.parse_arguments()
+    with open(f'{tmp_path}/empty.txt', 'w', encoding='utf-8') as outfile:
+        outfile.write('# nothing here\n')
+    monkeypatch.setattr(sys, 'argv', ['linkedin2username.py', '-b', f'{tmp_path}/empty.txt'])
+    with pytest.raises(SystemExit):
+        linkedin2username.parse_arguments()
+
+
+def test_write_files_templates(tmp_path):
+    employees = [Employee('John Davidson-Smith', 'Hacker'), Employee('Jane Smith', 'Painter')]
+    linkedin2username.write_files('acme', ['@acme.com', '@acme.co.uk'], employees, str(tmp_path),
+                                  templates=['{first}_{last}', '{l}{first}'])
+
+    # Every username, at every domain, one after the other
+    lines = read_output(tmp_path, 'acme', 'first_last')
+    assert sorted(lines) == ['jane_smith@acme.co.uk', 'jane_smith@acme.com', 'john_davidson@acme.co.uk',
+                             'john_davidson@acme.com', 'john_smith@acme.co.uk', 'john_smith@acme.com']
+    assert [line.split('@')[0] for line in lines[::2]] == [line.split('@')[0] for line in lines[1::2]]
+    assert sorted(read_output(tmp_path, 'acme', 'lfirst')) == [
+        'djohn@acme.co.uk', 'djohn@acme.com', 'sjane@acme.co.uk', 'sjane@acme.com', 'sjohn@acme.co.uk', 'sjohn@acme.com']
+
+    # Worker processes compile the same templates for themselves
+    linkedin2username.write_files('parallel', '', employees * 3, str(tmp_path), processes=2,
+                                  templates=['{l}{first}'])
+    assert sorted(read_output(tmp_path, 'parallel', 'lfirst')) == ['djohn', 'sjane', 'sjohn']
+
+
+def test_bloom_filter():
+    seen = linkedin2username.BloomFilter(capacity=1000, error_rate=0.01)
+    # A few false positives are allowed, that's the trade-off
+    assert sum(seen.add_new(str(i)) for i in range(1000)) > 980
+    assert not any(seen.add_new(str(i)) for i in range(1000))
+
+
+def make_args(**options):
+    """The scraping options do_loops expects, with the defaults changed as needed."""
+    args = argparse.Namespace(geoblast=False, keywords=False, split=False, depth=20,
+                              sleep=0, workers=1, staff_count=0, dedup='exact', stale_pages=0,
+                              delta=False)
+    for option, value in options.items():
+        setattr(args, option, value)
+    return args
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """
+    Starts a StubServer with the given responder, and points the scraper at it.
+    Servers are closed at the end of the test.
+    """
+    servers = []
+
+    def start(responder):
+        server = StubServer(responder)
+        servers.append(server)
+        monkeypatch.setattr(linkedin2username, 'BASE_URL', server.url)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def run_loops(tmp_path, args, outer_loops=range(1), **options):
+    """Runs do_loops for acme, writing to tmp_path. Returns the number of people found."""
+    with linkedin2username.OutputWriter('acme', '', str(tmp_path)) as writer:
+        return linkedin2username.do_loops(requests.Session(), '1234', outer_loops, args, writer, **options)
+
+
+def keyword_responder(path):
+    """Three pages for 'sales', then one page and the commercial limit for 'hr'."""
+    page = page_of(path)
+    if 'keywords:sales' in path:
+        if page < 3:
+            return 200, make_page([f'Sales Person{letters(page, i)}' for i in range(50)], 150)
+        return 200, make_page([], 0)
+    if page == 0:
+        return 200, make_page(['Hr Person', 'Sales Personaxa'], 60)
+    return 200, '{"data": "UPSELL_LIMIT"}'
+
+
+def test_do_loops_concurrent(tmp_path, stub):
+    server = stub(keyword_responder)
+    found = run_loops(tmp_path, make_args(keywords=['sales', 'hr'], depth=10, workers=4), range(2))
+
+    # 150 sales people, plus one new person from hr
+    assert found == 151
+    assert len(read_output(tmp_path, 'acme', 'rawnames')) == 151
+
+    # Only the pages needed are fetched, no empty pages past the end
+    assert len(server.requests) == 3 + 2
+
+
+def test_profiler(tmp_path, monkeypatch, stub):
+    stub(keyword_responder)
+    monkeypatch.setattr(linkedin2username, 'PROFILER', linkedin2username.Profiler())
+    profiler = linkedin2username.PROFILER
+    args = make_args(keywords=['sales', 'hr'], depth=10, workers=2)
+
+    # Nothing is recorded until profiling is turned on
+    with profiler.stage('network'):
+        pass
+    assert not profiler.calls
+
+    profiler.enable(tracing=True)
+    run_loops(tmp_path, args, range(2))
+    profiler.report()
+    profiler.write_trace(f'{tmp_path}/trace.json')
+
+    assert profiler.counts['requests'] == 5
+    assert profiler.statuses == {200: 5}
+    assert profiler.counts['names'] == 152
+    assert profiler.calls['network'] == profiler.calls['parse'] == 5
+    with open(f'{tmp_path}/trace.json', encoding='utf-8') as infile:
+        events = json.load(infile)['traceEvents']
+    assert {event['name'] for event in events} == {'sleep', 'network', 'parse', 'write'}
+
+
+class SlowWriter():
+    """Stands in for an OutputWriter with a slow disk."""
+    def __init__(self):
+        self.written = []
+
+    def write(self, employee):
+        time.sleep(0.01)
+        if employee.full_name == 'Disk Full':
+            raise OSError('No space left on device')
+        self.written.append(employee.full_name)
+
+
+def test_background_writer():
+    slow = SlowWriter()
+    background = linkedin2username.BackgroundWriter(slow, max_pages=2)
+    pages = [[Employee(f'Person{letters(page, i)}', 'Staff') for i in range(5)] for page in range(6)]
+    start = time.perf_counter()
+    for page in pages:
+        background.write(page)
+        # Never more than two pages waiting to be written
+        assert background.queue.qsize() <= 2
+    queued = time.perf_counter() - start
+    background.close()
+
+    # Everything is written in order, and queueing up pages waited for the writer
+    assert slow.written == [employee.full_name for page in pages for employee in page]
+    assert queued >= 0.01 * 5 * 3
+
+    # Errors from the writer thread are raised when closing
+    background = linkedin2username.BackgroundWriter(SlowWriter())
+    background.write([Employee('Disk Full', 'Staff')])
+    background.write([Employee('John Smith', 'Staff')])
+    with pytest.raises(OSError):
+        background.close()
+
+
+def test_throttle(monkeypatch):
+    throttle = linkedin2username.Throttle(0.05)
+    start = time.monotonic()
+    threads = [threading.Thread(target=throttle.wait) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - start >= 0.15
+
+    # A burst goes straight through, and then we're back to one per interval
+    throttle = linkedin2username.Throttle(0.05, burst=3)
+    start = time.monotonic()
+    for _ in range(3):
+        throttle.wait()
+    assert time.monotonic() - start < 0.05
+    throttle.wait()
+    assert time.monotonic() - start >= 0.05
+
+    # Backing off slows down and pauses, and healthy responses bring us back up to speed
+    monkeypatch.setattr(linkedin2username, 'BACKOFF', 0.02)
+    throttle = linkedin2username.Throttle(0)
+    throttle.backoff(0.1)
+    throttle.backoff()
+    assert throttle.interval == 0.04
+    start = time.monotonic()
+    throttle.wait()
+    assert time.monotonic() - start >= 0.09
+    for _ in range(50):
+        throttle.healthy()
+    assert throttle.interval == 0
+
+
+def test_retry_after():
+    def response(value):
+        result = requests.Response()
+        if value is not None:
+            result.headers['Retry-After'] = value
+        return result
+
+    assert linkedin2username.retry_after(response(None)) is None
+    assert linkedin2username.retry_after(response('garbage')) is None
+    assert linkedin2username.retry_after(response('120')) == 120
+    assert linkedin2username.retry_after(response('Wed, 21 Oct 2015 07:28:00 GMT')) == 0
+    soon = email.utils.formatdate(time.time() + 60, usegmt=True)
+    assert 55 < linkedin2username.retry_after(response(soon)) <= 60
+
+
+def test_do_loops_retries(tmp_path, monkeypatch, stub):
+    failures = collections.Counter()
+
+    def responder(path):
+        # Every sales page is rate limited, then hits a server error, before working
+        page = page_of(path)
+        failures[page] += 1
+        if failures[page] == 1:
+            return 429, 'slow down', {'Retry-After': '0'}
+        if failures[page] == 2:
+            return 503, 'oops'
+        return keyword_responder(path)
+
+    server = stub(responder)
+    monkeypatch.setattr(linkedin2username, 'BACKOFF', 0.01)
+    args = make_args(keywords=['sales'], depth=10, workers=2)
+    throttle = linkedin2username.Throttle(0)
+    found = run_loops(tmp_path, args, throttle=throttle)
+
+    # Nothing was lost. Six bad responses doubled the interval each time, and
+    # the three good ones after that started to bring it back down.
+    assert found == 150
+    assert len(server.requests) == 3 * 3
+    assert throttle.interval < 0.01 * 2 ** 5
+
+    # Giving up after RETRIES, leaving check_page to stop the loop as before
+    monkeypatch.setattr(linkedin2username, 'RETRIES', 2)
+    server = stub(lambda path: (503, 'down for good'))
+    assert run_loops(tmp_path, args) == 0
+    assert len(server.requests) == 3
+
+
+def test_fetch_page_stop(stub):
+    server = stub(lambda path: (429, 'slow down', {'Retry-After': '1000'}))
+    throttle = linkedin2username.Throttle(0)
+    errors = []
+
+    def fetch():
+        try:
+            linkedin2username.fetch_page(requests.Session(), '1234', 0, '', '', throttle)
+        except linkedin2username.Stopped as err:
+            errors.append(err)
+
+    thread = threading.Thread(target=fetch)
+    thread.start()
+    while not server.requests:
+        time.sleep(0.01)
+
+    # Retry-After is capped, and stopping cuts the pause short without another try
+    time.sleep(0.1)
+    assert throttle.paused_until - time.monotonic() <= linkedin2username.MAX_RETRY_AFTER
+    throttle.stop()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert errors
+    assert len(server.requests) == 1
+    assert not throttle.wait()
+
+
+def test_response_cache(tmp_path, stub):
+    server = stub(keyword_responder)
+    args = make_args(keywords=['sales'], depth=10)
+    cache = linkedin2username.ResponseCache(str(tmp_path / 'cache.db'), 1)
+    for _ in range(2):
+        assert run_loops(tmp_path, args, cache=cache) == 150
+
+    # Three pages of names, all served from the cache the second time
+    assert len(server.requests) == 3
+    assert (cache.hits, cache.misses) == (3, 3)
+
+    # Expired entries count as misses
+    cache.ttl = -1
+    assert cache.get('1234', '', 'sales', 0) is None
+    cache.close()
+
+
+def test_checkpoint_resume(tmp_path, monkeypatch, stub):
+    broken = [True]
+
+    def responder(path):
+        # The third page of sales fails on the first run only
+        if broken[0] and 'start:100' in path and 'keywords:sales' in path:
+            return 500, 'oops'
+        return keyword_responder(path)
+
+    server = stub(responder)
+    monkeypatch.setattr(linkedin2username, 'BACKOFF', 0)
+    args = make_args(keywords=['sales', 'hr'], depth=10)
+    journal = str(tmp_path / 'checkpoint.jsonl')
+    checkpoint = linkedin2username.Checkpoint(journal)
+    assert run_loops(tmp_path, args, range(2), checkpoint=checkpoint) == 101
+    checkpoint.close()
+
+    broken[0] = False
+    server.requests.clear()
+    with linkedin2username.OutputWriter('acme', '', str(tmp_path)) as writer:
+        checkpoint = linkedin2username.Checkpoint(journal, resume=True)
+        restored = checkpoint.replay(writer)
+        assert len(restored) == 50 + 50 + 2
+        assert linkedin2username.do_loops(requests.Session(), '1234', range(2),
+                                          args, writer, checkpoint=checkpoint, known=restored) == 151
+        checkpoint.close()
+
+    # Only the failed sales page was fetched again, and the hr page that hit the
+    # commercial search limit.
+    assert [page_of(path) for path in server.requests] == [2, 1]
+
+
+def test_read_employees(tmp_path):
+    employees = [Employee('Hannibal Lecter, PhD', 'Psychiatrist, Chef'),
+                 Employee('John Smith', '')]
+    linkedin2username.write_files('acme', '', employees, str(tmp_path))
+
+    # Metadata round trips, even with commas
+    assert list(linkedin2username.read_employees(f'{tmp_path}/acme-metadata.txt')) == employees
+
+    assert list(linkedin2username.read_employees(f'{tmp_path}/acme-rawnames.txt')) == [
+        Employee('Hannibal Lecter, PhD', ''),
+        Employee('John Smith', '')]
+
+    # Metadata from older versions, which didn't quote commas
+    with open(f'{tmp_path}/old-metadata.txt', 'w', encoding='utf-8') as outfile:
+        outfile.write('full_name,occupation\nJohn Smith,Boss, Big\n')
+    assert list(linkedin2username.read_employees(f'{tmp_path}/old-metadata.txt')) == [
+        Employee('John Smith', 'Boss, Big')]
+
+    # Cached responses
+    cache = linkedin2username.ResponseCache(f'{tmp_path}/cache.db', 1)
+    with open("tests/mock-employee-response", "rb") as infile:
+        cache.put('1234', '', '', 0, infile.read())
+    cache.put('1234', '', '', 1, make_page([], 0).encode('utf-8'))
+    cache.close()
+    assert [employee.full_name for employee in
+            linkedin2username.read_employees(f'{tmp_path}/cache.db')] == ['Michael Myers', 'Freddy Krueger']
+
+    # A cache shared by a batch run has other companies in it too
+    cache = linkedin2username.ResponseCache(f'{tmp_path}/cache.db', 1)
+    cache.put('5678', '', '', 0, make_page(['Other Person'], 1).encode('utf-8'))
+    assert cache.company_ids() == ['1234', '5678']
+    cache.close()
+    assert [employee.full_name for employee in
+            linkedin2username.read_employees(f'{tmp_path}/cache.db', '5678')] == ['Other Person']
+
+
+def test_regenerate_checks(tmp_path, monkeypatch):
+    cache = linkedin2username.ResponseCache(f'{tmp_path}/cache.db', 1)
+    cache.put('1234', '', '', 0, make_page(['Acme Person'], 1).encode('utf-8'))
+    cache.put('5678', '', '', 0, make_page(['Other Person'], 1).encode('utf-8'))
+    cache.close()
+
+    def run(*options):
+        monkeypatch.setattr(sys, 'argv', ['linkedin2username.py', '-c', 'acme', '-o', f'{tmp_path}/out',
+                                          *options])
+        linkedin2username.regenerate(linkedin2username.parse_arguments())
+
+    # Missing files, and caches holding more than one company, need sorting out first
+    for options in ([f'-f{tmp_path}/missing.txt'], ['-f', f'{tmp_path}/cache.db'],
+                    ['-f', f'{tmp_path}/cache.db', '--company-id', '9999']):
+        with pytest.raises(SystemExit):
+            run(*options)
+
+    run('-f', f'{tmp_path}/cache.db', '--company-id', '1234')
+    assert read_output(f'{tmp_path}/out', 'acme', 'rawnames') == ['Acme Person']
+
+    # Reading back one of our own output files would wipe it out first
+    for suffix in ('metadata', 'flast'):
+        with pytest.raises(SystemExit):
+            run('-f', f'{tmp_path}/out/acme-{suffix}.txt')
+
+    # But another company's files in the same directory are fine
+    linkedin2username.write_files('acme-labs', '', [Employee('Labs Person', 'Staff')], f'{tmp_path}/out')
+    run('-f', f'{tmp_path}/out/acme-labs-metadata.txt')
+    assert read_output(f'{tmp_path}/out', 'acme', 'rawnames') == ['Labs Person']
+
+
+def test_write_files_parallel(tmp_path):
+    employees = [Employee(name, 'Staff') for name in generate_names(3000)]
+    linkedin2username.write_files('single', '', employees, str(tmp_path))
+    linkedin2username.write_files('multi', '', iter(employees), str(tmp_path), processes=2)
+
+    for suffix in ['rawnames', 'metadata'] + [suffix for suffix, _ in linkedin2username.OUTPUT_FORMATS]:
+        with open(f'{tmp_path}/single-{suffix}.txt', encoding='utf-8') as single, \
+             open(f'{tmp_path}/multi-{suffix}.txt', encoding='utf-8') as multi:
+            assert sorted(single) == sorted(multi)
+
+
+def test_find_employees_stdlib(monkeypatch):
+    # orjson is optional, so make sure things work just as well without it
+    monkeypatch.setattr(linkedin2username, 'json_loads', json.loads)
+    with open("tests/mock-employee-response", "r") as infile:
+        result = infile.read()
+    assert linkedin2username.find_employees(result) == [Employee('Michael Myers', 'Camp Counsellor'),
+                                                        Employee('Freddy Krueger', 'Babysitter')]
+    assert linkedin2username.find_employees(result[:500]) is False
+
+
+def test_check_page_bytes(monkeypatch):
+    # CachedResponse has no .text, so this also checks the body is never decoded to a str
+    with open("tests/mock-employee-response", "rb") as infile:
+        result = linkedin2username.CachedResponse(200, infile.read())
+    for loads in (linkedin2username.json_loads, json.loads):
+        monkeypatch.setattr(linkedin2username, 'json_loads', loads)
+        assert linkedin2username.check_page(result)[0] == [Employee('Michael Myers', 'Camp Counsellor'),
+                                                           Employee('Freddy Krueger', 'Babysitter')]
+        assert linkedin2username.check_page(linkedin2username.CachedResponse(200, b'\xff{')) == ([], 0)
+    upsell = linkedin2username.CachedResponse(200, b'{"type": "UPSELL_LIMIT"}')
+    assert linkedin2username.check_page(upsell) == (None, 0)
+
+
+def region_responder(path):
+    """120 people in the US, 60 in Great Britain, and nobody anywhere else."""
+    page = page_of(path)
+    totals = {linkedin2username.GEO_REGIONS['gb']: 60, linkedin2username.GEO_REGIONS['us']: 120}
+    region = re.search(r'key:geoUrn,value:List\((\d+)\)', path).group(1)
+    total = totals.get(region, 0)
+    count = max(0, min(50, total - page * 50))
+    return 200, make_page([f'Person{letters(region)} Number{letters(page, i)}' for i in range(count)], total)
+
+
+def test_do_loops_geoblast(tmp_path, stub):
+    server = stub(region_responder)
+    args = make_args(geoblast=True)
+    found = run_loops(tmp_path, args, linkedin2username.set_outer_loops(args))
+
+    assert found == 180
+
+    # One probe per region, then only the pages the two busy regions need, biggest first
+    regions = len(linkedin2username.GEO_REGIONS)
+    assert len(server.requests) == regions + 3
+    assert [page_of(path) for path in server.requests[regions:]] == [1, 2, 1]
+    assert linkedin2username.GEO_REGIONS['us'] in server.requests[regions]
+
+
+def split_responder(path):
+    """Too many people overall, and too many in the US until split by keyword."""
+    page = page_of(path)
+    region = re.search(r'key:geoUrn,value:List\((\d+)\)', path)
+    region = region.group(1) if region else ''
+    keyword = re.search(r'keywords:(\w+)', path)
+    keyword = keyword.group(1) if keyword else ''
+    totals = {('', ''): 3000,
+              (linkedin2username.GEO_REGIONS['us'], ''): 1500,
+              (linkedin2username.GEO_REGIONS['us'], 'sales'): 900,
+              (linkedin2username.GEO_REGIONS['us'], 'hr'): 100,
+              (linkedin2username.GEO_REGIONS['gb'], ''): 60}
+    total = totals.get((region, keyword), 0)
+    count = max(0, min(50, total - page * 50))
+    return 200, make_page([f'Person{letters(region)}{keyword} Number{letters(page, i)}' for i in range(count)], total)
+
+
+def test_do_loops_split(tmp_path, stub):
+    server = stub(split_responder)
+    args = make_args(split=True, keywords=['sales', 'hr'], workers=3, staff_count=3000)
+    found = run_loops(tmp_path, args, linkedin2username.set_outer_loops(args))
+
+    # The first page of the two searches that were split, plus everything from the rest
+    assert found == 50 + 50 + 60 + 900 + 100
+
+    # Each search is probed once, then only the pages still needed are fetched
+    regions = len(linkedin2username.GEO_REGIONS)
+    assert len(server.requests) == 1 + regions + 2 + 1 + 17 + 1
+
+
+def overlap_responder(path):
+    """'everyone' and 'staff' find the same people, with slightly different names."""
+    page = page_of(path)
+    suffix = ', PhD' if 'keywords:staff' in path else ''
+    return 200, make_page([f'Same Person{letters(page, i)}{suffix}' for i in range(50)], 500)
+
+
+def test_do_loops_dedup_index(tmp_path, stub):
+    server = stub(overlap_responder)
+    found = run_loops(tmp_path, make_args(keywords=['everyone', 'staff'], stale_pages=2), range(2))
+
+    # Nobody from the second keyword is new, so it gives up after two pages
+    assert found == 500
+    assert len(server.requests) == 10 + 2
+
+
+def test_do_loops_non_latin(tmp_path, stub):
+    names = ['Иван Петров', 'Анна Смирнова', '王伟', '李娜', 'John Smith']
+    stub(lambda path: (200, make_page(names if 'start:0' in path else [], len(names))))
+
+    # Names that clean up to nothing are still different people
+    assert run_loops(tmp_path, make_args()) == 5
+    assert read_output(tmp_path, 'acme', 'rawnames') == names
+
+
+def test_do_loops_resume_index(tmp_path, stub):
+    server = stub(overlap_responder)
+    journal = str(tmp_path / 'checkpoint.jsonl')
+    checkpoint = linkedin2username.Checkpoint(journal)
+    run_loops(tmp_path, make_args(keywords=['everyone']), checkpoint=checkpoint)
+    checkpoint.close()
+
+    server.requests.clear()
+    with linkedin2username.OutputWriter('acme', '', str(tmp_path)) as writer:
+        checkpoint = linkedin2username.Checkpoint(journal, resume=True)
+        restored = checkpoint.replay(writer)
+        found = linkedin2username.do_loops(requests.Session(), '1234', range(2),
+                                           make_args(keywords=['everyone', 'staff'], stale_pages=2),
+                                           writer, checkpoint=checkpoint, known=restored)
+        checkpoint.close()
+
+    # Everyone restored from the journal counts as found, so the second
+    # keyword still gives up after two pages
+    assert found == 500
+    assert len(server.requests) == 2
+
+
+def test_new_session(stub):
+    failures = [1]
+
+    def responder(path):
+        # Fails once, then works every time
+        if failures[0]:
+            failures[0] -= 1
+            return 503, 'try again'
+        return 200, make_page(['John Smith'], 1)
+
+    server = stub(responder)
+    session = linkedin2username.new_session(pool_size=2, backoff=0)
+    stats = linkedin2username.SessionStats(session)
+
+    # Error responses are left for fetch_page to retry, so it can slow everyone down
+    assert session.get(server.url + '/test').status_code == 503
+    for _ in range(3):
+        assert session.get(server.url + '/test').status_code == 200
+
+    # Every request shared a connection
+    assert len(server.requests) == 4
+    assert stats.connections() == (4, 1)
+    assert len(stats.latencies) == 4
+    assert stats.body_bytes == 3 * len(make_page(['John Smith'], 1)) + len('try again')
+    assert 'gzip' in session.headers['Accept-Encoding']
+
+
+def batch_responder(path):
+    """Two small companies, with one person working for both."""
+    company = re.search(r'currentCompany,value:List\((\d+)\)', path).group(1)
+    names = {'1': ['Alice Shared', 'Bob One'], '2': ['Alice Shared', 'Carol Two', 'Dan Two']}[company]
+    return 200, make_page(names, len(names))
+
+
+def test_batch(tmp_path, monkeypatch, stub):
+    server = stub(batch_responder)
+    monkeypatch.setattr(linkedin2username, 'login', lambda *args: requests.Session())
+    companies = {'acme': ('1', 2), 'acme-labs': ('2', 3)}
+    monkeypatch.setattr(linkedin2username, 'get_company_info', lambda name, session: companies[name])
+    with open(f'{tmp_path}/companies.txt', 'w', encoding='utf-8') as outfile:
+        outfile.write('acme\n# subsidiaries\nacme-labs\n\nacme\n')
+    args = make_args(batch=f'{tmp_path}/companies.txt', company=False, output=str(tmp_path),
+                     companies=linkedin2username.read_companies(f'{tmp_path}/companies.txt'),
+                     domain='', workers=2, proxy=False, stats=False, cache=False, resume=False,
+                     session_file=False, fresh_login=False, delta=False, templates=False)
+    linkedin2username.scrape(args)
+
+    # Each company gets its own files, and one list has everyone
+    assert read_output(tmp_path, 'acme', 'rawnames') == ['Alice Shared', 'Bob One']
+    assert read_output(tmp_path, 'acme-labs', 'rawnames') == ['Alice Shared', 'Carol Two', 'Dan Two']
+    assert sorted(read_output(tmp_path, 'merged', 'flast')) == ['ashared', 'bone', 'ctwo', 'dtwo']
+
+    # The repeated company is only scraped once
+    assert len(server.requests) == 2
+
+
+def delta_responder(path):
+    """150 people over three pages, with one new hire turning up first."""
+    page = page_of(path)
+    names = [f'Old Timer{letters(page, i)}' for i in range(50)]
+    if page == 0:
+        names[0] = 'New Hire'
+    return 200, make_page(names, 150)
+
+
+def test_delta(tmp_path, stub):
+    server = stub(delta_responder)
+    with open(f'{tmp_path}/acme-metadata.txt', 'w', encoding='utf-8') as outfile:
+        outfile.write('full_name,occupation\n')
+        for page in range(3):
+            for i in range(50):
+                outfile.write(f'Old Timer{letters(page, i)},Staff\n')
+    args = make_args(output=str(tmp_path), domain='', resume=False, delta=True, templates=False)
+    found = linkedin2username.scrape_company(requests.Session(), 'acme', '1234', 150, args)
+
+    # The second page had nobody new, so the third is never fetched
+    assert len(server.requests) == 2
+    assert found == 151
+
+    # Everyone is in the full set, and only the new hire in the new files
+    assert len(read_output(tmp_path, 'acme', 'rawnames')) == 151
+    assert read_output(tmp_path, 'acme-new', 'rawnames') == ['New Hire']
+    assert read_output(tmp_path, 'acme-new', 'flast') == ['nhire']
+
+
+def test_delta_resume(tmp_path, monkeypatch, stub):
+    broken = [True]
+
+    def responder(path):
+        # The second page fails on the first run only
+        if broken[0] and 'start:50' in path:
+            return 500, 'oops'
+        return delta_responder(path)
+
+    stub(responder)
+    monkeypatch.setattr(linkedin2username, 'BACKOFF', 0)
+    with open(f'{tmp_path}/acme-metadata.txt', 'w', encoding='utf-8') as outfile:
+        outfile.write('full_name,occupation\n')
+        for page in range(3):
+            for i in range(50):
+                outfile.write(f'Old Timer{letters(page, i)},Staff\n')
+    args = make_args(output=str(tmp_path), domain='', resume=False, delta=True, templates=False)
+    linkedin2username.scrape_company(requests.Session(), 'acme', '1234', 150, args)
+    broken[0] = False
+    args.resume = True
+    found = linkedin2username.scrape_company(requests.Session(), 'acme', '1234', 150, args)
+
+    # The interrupted run overwrote the metadata file, but the new hire found
+    # before the crash is still new after resuming
+    assert found == 151
+    assert read_output(tmp_path, 'acme-new', 'rawnames') == ['New Hire']
+
+
+def test_scrape_company_new_output(tmp_path, stub):
+    stub(delta_responder)
+    args = make_args(output=f'{tmp_path}/li2u-output', domain='', resume=False, delta=False, templates=False)
+
+    # The output directory is created on the first run, before the journal is opened
+    assert linkedin2username.scrape_company(requests.Session(), 'acme', '1234', 150, args) == 150
+    assert os.path.exists(f'{tmp_path}/li2u-output/acme-checkpoint.jsonl')
+
+
+class FakeDriver():
+    """Stands in for a Selenium browser that has just been logged in to."""
+    def __init__(self):
+        self.used = False
+
+    def get(self, url):
+        self.used = True
+
+    def get_cookies(self):
+        return [{'name': 'JSESSIONID', 'value': '"ajax:42"'}, {'name': 'li_at', 'value': 'fresh'}]
+
+    def quit(self):
+        pass
+
+
+def test_saved_session(tmp_path, monkeypatch, stub):
+    logged_in = True
+    server = stub(lambda path: (200 if logged_in else 401, '{}'))
+    monkeypatch.setattr('builtins.input', lambda prompt: '')
+    driver = FakeDriver()
+    monkeypatch.setattr(linkedin2username, 'get_webdriver', lambda: driver)
+    session_file = f'{tmp_path}/session.json'
+
+    # Nothing saved yet, so the browser is used and the session is saved
+    linkedin2username.login(session_file=session_file)
+    assert driver.used
+    assert os.stat(session_file).st_mode & 0o777 == 0o600
+
+    # Next time, the saved session is checked with one request and used as is
+    driver.used = False
+    session = linkedin2username.login(session_file=session_file)
+    assert not driver.used
+    assert server.requests == ['/voyager/api/me']
+    assert session.headers['Csrf-Token'] == 'ajax:42'
+    assert session.cookies['li_at'] == 'fresh'
+
+    # Until LinkedIn stops accepting it
+    logged_in = False
+    linkedin2username.login(session_file=session_file)
+    assert driver.used
+
+    # A session that can't be saved is still used
+    session = linkedin2username.login(session_file=f'{tmp_path}/missing/session.json')
+    assert session.cookies['li_at'] == 'fresh'
+    assert not os.path.exists(f'{tmp_path}/missing')
+
+    # The proxy is set before the saved session is checked
+    logged_in = True
+    session = linkedin2username.login(session_file=session_file, proxy='http://127.0.0.1:8080')
+    assert session.proxies == {'https': 'http://127.0.0.1:8080'}
+    assert not session.verify
+
+
+def test_import_time():
+    # A fresh interpreter, so nothing imported by the tests themselves counts
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import linkedin2username'],
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            capture_output=True, text=True, check=True)
+    imported = [line.split('|')[-1].strip() for line in result.stderr.splitlines()[1:]]
+
+    # The slow dependencies wait until a session or browser is needed
+    heavy = [module for module in imported if module.split('.')[0] in ('requests', 'urllib3', 'selenium')]
+    assert not heavy, f"imported at startup: {heavy}"